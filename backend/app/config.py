@@ -1,6 +1,8 @@
 """
 Configuration for AI Outfit Recommender
 """
+import re
+from functools import lru_cache
 from pydantic_settings import BaseSettings
 from typing import Optional
 
@@ -17,13 +19,25 @@ class Settings(BaseSettings):
     API_HOST: str = "0.0.0.0"
     API_PORT: int = 8000
     API_PREFIX: str = "/api/v1"
+    # Worker processes for `python -m app.main` (0 = one per CPU; ignored with DEBUG reload).
+    # Caches, idempotency keys, memory:// rate limits and queued try-on jobs are
+    # per-process. Jobs are only pollable on the worker that accepted them, so
+    # the launcher refuses more than one worker while the job queue is in-process.
+    WORKERS: int = 1
     
     # Groq LLM (Free tier)
     GROQ_API_KEY: str = ""
     GROQ_MODEL: str = "llama-3.1-8b-instant"
+    # Concurrent prompt parses arriving within the wait window share one Groq
+    # request (up to the max size); PARSE_BATCH_MAX_SIZE=1 disables batching
+    PARSE_BATCH_MAX_SIZE: int = 16
+    PARSE_BATCH_MAX_WAIT_MS: int = 25
     
     # Replicate API (Virtual Try-On)
     REPLICATE_API_TOKEN: str = ""
+    # Garment extraction: wait for Replicate (best masks) and only fall back to
+    # rembg on failure; False races both and takes whichever finishes first
+    GARMENT_EXTRACTION_PREFER_QUALITY: bool = True
     
     # Cloudinary (Image Storage)
     CLOUDINARY_CLOUD_NAME: str = ""
@@ -33,11 +47,13 @@ class Settings(BaseSettings):
     # RapidAPI (ASOS Products)
     RAPIDAPI_KEY: str = ""
     
-    # CORS Origins (comma-separated string, or leave empty for defaults)
+    # CORS Origins (comma-separated string, or leave empty for defaults; "*" wildcards allowed)
     CORS_ORIGINS: str = "http://localhost:3000,http://localhost:5173,http://localhost:5174,http://localhost:5175"
     
     # Rate Limiting
     RATE_LIMIT_PER_MINUTE: int = 10
+    # Limiter storage shared by all workers, e.g. redis://host:6379 (memory:// is per-process)
+    RATE_LIMIT_STORAGE_URI: str = "memory://"
     
     # Logging
     LOG_LEVEL: str = "INFO"
@@ -54,22 +70,45 @@ class Settings(BaseSettings):
         "env_file": ".env",
         "case_sensitive": True,
         "extra": "ignore",
+        # Settings are read-only after startup
+        "frozen": True,
     }
 
 
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Build settings once (parses .env and the environment on first call)"""
+    return Settings()
+
+
 # Global settings instance
-settings = Settings()
+settings = get_settings()
 
 
-def get_cors_origins() -> list:
-    """Get CORS origins as a list"""
+@lru_cache(maxsize=1)
+def get_cors_origins() -> tuple:
+    """Get CORS origins (parsed once; settings are frozen)"""
     if not settings.CORS_ORIGINS:
         # Default origins if not set
-        return [
+        return (
             "http://localhost:3000",
             "http://localhost:5173",
             "http://localhost:5174",
             "http://localhost:5175",
-        ]
+        )
     # Parse comma-separated string
-    return [origin.strip() for origin in settings.CORS_ORIGINS.split(",") if origin.strip()]
+    return tuple(origin.strip() for origin in settings.CORS_ORIGINS.split(",") if origin.strip())
+
+
+@lru_cache(maxsize=1)
+def get_cors_origin_regex() -> Optional[str]:
+    """
+    Single regex for wildcard origins such as https://*.vercel.app
+    (None if every origin is an exact match)
+    """
+    patterns = [
+        re.escape(origin).replace(r"\*", "[^/]*")
+        for origin in get_cors_origins()
+        if "*" in origin and origin != "*"
+    ]
+    return "|".join(patterns) or None
@@ -2,16 +2,18 @@
 AI Outfit Recommender - FastAPI Application
 Simplified version without PostgreSQL database
 """
-from fastapi import FastAPI, HTTPException, Request, File, UploadFile
+from fastapi import FastAPI, HTTPException, Request, Response, File, Form, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, TypeAdapter
+from typing import Dict, List, Optional
+import asyncio
 import time
-import uuid
+import secrets
 from datetime import datetime
 import logging
-import io
+import orjson
 
 # Rate Limiting
 from slowapi import Limiter, _rate_limit_exceeded_handler
@@ -22,11 +24,16 @@ from slowapi.errors import RateLimitExceeded
 import cloudinary
 import cloudinary.uploader
 
+# Image processing
+from PIL import Image
+
 # App imports
-from app.config import settings, get_cors_origins
+from app.config import settings, get_cors_origins, get_cors_origin_regex
 from app.models import (
     OutfitPromptRequest,
     OutfitResponse,
+    BatchBrowseRequest,
+    BatchBrowseResponse,
     GeneratedOutfit,
     HealthCheck,
     ProductItem,
@@ -36,8 +43,18 @@ from app.services.product_service import product_service
 from app.services.tryon_service import tryon_service
 from app.services.asos_service import asos_service
 from app.services.amazon_service import amazon_service
-from app.services.firebase_auth import verify_firebase_token, get_user_id_from_token
-from app.services.usage_tracker import get_user_usage, increment_search, increment_tryon, get_admin_stats, get_global_usage
+from app.services.firebase_auth import verify_firebase_token, get_user_id_from_token, close_http_client
+from app.services.cache import TTLCache
+from app.services.idempotency import idempotent
+from app.services.job_queue import tryon_jobs
+from app.services.usage_tracker import (
+    get_user_usage,
+    check_and_increment_search,
+    check_and_increment_tryon,
+    get_admin_stats,
+    get_global_usage,
+    get_global_usage_cached,
+)
 
 # Sentry Error Monitoring (optional)
 import sentry_sdk
@@ -73,38 +90,82 @@ app = FastAPI(
     version=settings.APP_VERSION,
     description="AI-powered outfit recommendation with virtual try-on",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse
 )
 
-# Rate Limiter
-limiter = Limiter(key_func=get_remote_address)
+# Rate Limiter (keyed by signed-in user, else client IP)
+def _user_or_ip_key(request: Request) -> str:
+    """Rate limit key: the user set by attach_firebase_user, else client IP"""
+    user_id = getattr(request.state, "user_id", None)
+    if user_id:
+        return f"user:{user_id}"
+    return get_remote_address(request)
+
+
+limiter = Limiter(
+    key_func=_user_or_ip_key,
+    storage_uri=settings.RATE_LIMIT_STORAGE_URI,
+    strategy="moving-window"
+)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
-# CORS middleware
+# Gzip JSON responses (added before CORS so CORS wraps it)
+app.add_middleware(GZipMiddleware, minimum_size=512, compresslevel=5)
+
+# CORS middleware (exact origins as a set for O(1) lookups, wildcards as one regex)
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=get_cors_origins(),
+    allow_origins=frozenset(origin for origin in get_cors_origins() if "*" not in origin or origin == "*"),
+    allow_origin_regex=get_cors_origin_regex(),
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
 
+# ==================== CONSTANTS ====================
+
+SEARCH_EXHAUSTED_DETAIL = "You've already used your 1 free search. Thank you for trying our app!"
+GLOBAL_SEARCH_EXHAUSTED_DETAIL = "Sorry, we've reached our search limit. Please try again later."
+TRYON_EXHAUSTED_DETAIL = "You've already used your 1 free virtual try-on. Thank you for trying our app!"
+GLOBAL_TRYON_EXHAUSTED_DETAIL = "Sorry, we've reached our try-on limit. Please try again later."
+USAGE_UPDATE_FAILED_DETAIL = "Unable to process. Please try again."
+
+# Config flags read per request (settings are frozen after startup)
+RAPIDAPI_CONFIGURED = bool(settings.RAPIDAPI_KEY)
+CLOUDINARY_CONFIGURED = bool(settings.CLOUDINARY_CLOUD_NAME)
+DEFAULT_MODEL_IMAGE_URL = settings.MODEL_IMAGE_URL
+
+# Responses replayed for retries with the same Idempotency-Key (seconds)
+IDEMPOTENCY_TTL = 600
+
+
+def _limit_detail(reason: Optional[str], user_detail: str, global_detail: str) -> str:
+    """429 message for a check_and_increment_* refusal reason"""
+    if reason == "user_exhausted":
+        return user_detail
+    if reason == "global_exhausted":
+        return global_detail
+    return USAGE_UPDATE_FAILED_DETAIL
+
+
 # ==================== STARTUP ====================
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize services on startup"""
     logger.info("=" * 60)
-    logger.info(f"🚀 Starting {settings.APP_NAME} v{settings.APP_VERSION}")
+    logger.info("🚀 Starting %s v%s", settings.APP_NAME, settings.APP_VERSION)
     logger.info("=" * 60)
-    logger.info(f"LLM service: configured={llm_service.is_configured}")
-    logger.info(f"ASOS API: {'configured' if settings.RAPIDAPI_KEY else 'not configured'}")
-    logger.info(f"Amazon API: {'configured' if settings.RAPIDAPI_KEY else 'not configured'}")
-    logger.info(f"Cloudinary: {'configured' if settings.CLOUDINARY_CLOUD_NAME else 'not configured'}")
-    logger.info(f"Replicate: {'configured' if settings.REPLICATE_API_TOKEN else 'not configured'}")
+    logger.info("LLM service: configured=%s", llm_service.is_configured)
+    logger.info("ASOS API: %s", 'configured' if settings.RAPIDAPI_KEY else 'not configured')
+    logger.info("Amazon API: %s", 'configured' if settings.RAPIDAPI_KEY else 'not configured')
+    logger.info("Cloudinary: %s", 'configured' if settings.CLOUDINARY_CLOUD_NAME else 'not configured')
+    logger.info("Replicate: %s", 'configured' if settings.REPLICATE_API_TOKEN else 'not configured')
     logger.info("=" * 60)
+    tryon_jobs.start()
     logger.info("✅ Application startup complete")
     logger.info("=" * 60)
 
@@ -112,13 +173,29 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("👋 Shutting down application...")
+    await tryon_jobs.stop()
+    await tryon_service.aclose()
+    await asos_service.aclose()
+    await amazon_service.aclose()
+    await close_http_client()
+    
+    # Imported lazily, as in the try-on endpoint
+    from app.services.garment_extractor import garment_extractor
+    await garment_extractor.aclose()
 
 
 # ==================== HEALTH CHECK ====================
 
-@app.get("/health", response_model=HealthCheck, tags=["Health"])
-async def health_check():
-    """Check system health"""
+# Health responses are treated as unchanged within a 5 second window
+HEALTH_ETAG_BUCKET_SECONDS = 5
+
+# One real probe (incl. a Groq request) per 2 seconds, shared by concurrent pollers
+HEALTH_CACHE_TTL = 2.0
+_health_cache = TTLCache(maxsize=1, ttl=HEALTH_CACHE_TTL)
+
+
+async def _probe_health() -> HealthCheck:
+    """Check each backing service"""
     services = {}
     
     # Check LLM (Groq)
@@ -126,9 +203,9 @@ async def health_check():
     services["llm"] = llm_health.get("status", "unknown")
     
     # Check APIs
-    services["asos"] = "configured" if settings.RAPIDAPI_KEY else "not_configured"
-    services["amazon"] = "configured" if settings.RAPIDAPI_KEY else "not_configured"
-    services["cloudinary"] = "configured" if settings.CLOUDINARY_CLOUD_NAME else "not_configured"
+    services["asos"] = "configured" if RAPIDAPI_CONFIGURED else "not_configured"
+    services["amazon"] = "configured" if RAPIDAPI_CONFIGURED else "not_configured"
+    services["cloudinary"] = "configured" if CLOUDINARY_CONFIGURED else "not_configured"
     services["replicate"] = "configured" if settings.REPLICATE_API_TOKEN else "not_configured"
     
     return HealthCheck(
@@ -139,143 +216,341 @@ async def health_check():
     )
 
 
+@app.get(
+    "/health",
+    response_model=HealthCheck,
+    tags=["Health"],
+    responses={304: {"description": "Not modified since the caller's ETag"}}
+)
+async def health_check(request: Request, response: Response):
+    """Check system health"""
+    # Pollers within the same window get a bodiless 304
+    etag = f'"health-{int(time.time() // HEALTH_ETAG_BUCKET_SECONDS)}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    
+    # Cache the probe task itself so a burst of callers awaits a single probe
+    probe = _health_cache.get("health")
+    if probe is None:
+        probe = asyncio.ensure_future(_probe_health())
+        _health_cache.set("health", probe)
+    
+    try:
+        # Shielded: one poller disconnecting must not cancel the shared probe
+        return await asyncio.shield(probe)
+    except Exception:
+        _health_cache.pop("health")
+        raise
+
+
 # ==================== HELPER: GET FIREBASE USER ====================
 
+@app.middleware("http")
+async def attach_firebase_user(request: Request, call_next):
+    """Verify the bearer token once per request (shared by the limiter and endpoints)"""
+    request.state.user_id = await _verify_request_user(request)
+    return await call_next(request)
+
+
 async def get_firebase_user(request: Request) -> Optional[str]:
     """Get Firebase user ID from Authorization header"""
+    # Already verified by attach_firebase_user
+    if hasattr(request.state, "user_id"):
+        return request.state.user_id
+    
+    return await _verify_request_user(request)
+
+
+async def _verify_request_user(request: Request) -> Optional[str]:
+    """Verify the Authorization header's Firebase token and return the user ID"""
     auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
+    if not auth_header or len(auth_header) < 8 or auth_header[:7] != "Bearer ":
         return None
     
-    token = auth_header.split(" ")[1]
+    token = auth_header[7:]
     
     try:
         payload = await verify_firebase_token(token)
         if payload:
             return get_user_id_from_token(payload)
     except Exception as e:
-        logger.warning(f"Firebase token verification failed: {e}")
+        logger.warning("Firebase token verification failed: %s", e)
     
     return None
 
 
-# ==================== BROWSE OUTFITS (ASOS) ====================
+# ==================== HELPER: PRODUCT ITEMS ====================
 
-@app.post(
-    f"{settings.API_PREFIX}/outfits/browse-asos",
-    response_model=OutfitResponse,
-    tags=["Outfits"],
-    summary="Browse outfits from ASOS"
-)
-@limiter.limit("20/minute")
-async def browse_outfits_asos(request: Request, prompt_request: OutfitPromptRequest):
+# Validates a whole product list in one pydantic-core call
+_product_list_adapter = TypeAdapter(List[ProductItem])
+
+
+def to_product_items(products: List[Dict], tag_source: bool = False) -> List[ProductItem]:
     """
-    Browse outfit combinations from ASOS
+    Build ProductItems from store service dicts.
     
-    - Requires Google sign-in
-    - Limited to 2 searches per 5 days
-    - Returns 3 outfit combinations per search
+    The service dicts already use ProductItem's field names, so the list is
+    validated in bulk (extra keys like source/rating are ignored).
+    
+    Args:
+        products: Product dicts from the store services
+        tag_source: Append the store name to the brand (mixed results)
+    """
+    if tag_source:
+        products = [
+            {
+                **p,
+                "brand": f"{p.get('brand', 'Unknown')} ({p.get('source', 'unknown').upper()})",
+            }
+            for p in products
+        ]
+    
+    return _product_list_adapter.validate_python(products)
+
+
+# ==================== HELPER: RESPONSES ====================
+
+def model_response(model: BaseModel) -> ORJSONResponse:
+    """
+    Serialize an already-validated response model directly.
+    
+    Returning a Response skips FastAPI's response_model re-validation
+    (a full walk of the nested outfits/products); the route's
+    response_model still documents the schema.
+    """
+    return ORJSONResponse(content=model.model_dump(mode="json"))
+
+
+# ==================== HELPER: BROWSE ====================
+
+# Per-store settings for _browse_source
+BROWSE_SOURCE_CONFIG = {
+    "asos": {
+        "id_prefix": "asos",
+        "store_name": "ASOS",
+        "num_per_category": 5,
+        "log_label": "🛍️ Browsing",
+        "not_found": "No matching products found",
+        "found_label": "",
+    },
+    "amazon": {
+        "id_prefix": "amz",
+        "store_name": "Amazon",
+        "num_per_category": 5,
+        "log_label": "🛒 Amazon browse",
+        "not_found": "No matching products found on Amazon",
+        "found_label": " Amazon",
+    },
+    "mixed": {
+        "id_prefix": "mix",
+        "store_name": "Mixed Store",
+        "num_per_category": 3,
+        "log_label": "🔀 Mixed store browse",
+        "not_found": "No matching products found",
+        "found_label": " mixed",
+    },
+}
+
+
+async def authorize_search(request: Request) -> str:
+    """
+    Authenticate the caller and consume one search.
+    
+    Raises:
+        HTTPException: 401 if not signed in, 429 if the search limit is reached
+    """
+    # Fail fast once the global quota is used up (skips the per-user lookups)
+    if not get_global_usage_cached()["searches_available"]:
+        raise HTTPException(
+            status_code=429,
+            detail=GLOBAL_SEARCH_EXHAUSTED_DETAIL
+        )
+    
+    # Check authentication
+    user_id = await get_firebase_user(request)
+    if not user_id:
+        raise HTTPException(
+            status_code=401,
+            detail="Please sign in with Google to browse outfits."
+        )
+    
+    # Check usage limits (per-user AND global) and increment in one transaction
+    result = check_and_increment_search(user_id)
+    if not result["allowed"]:
+        raise HTTPException(
+            status_code=429,
+            detail=_limit_detail(result["reason"], SEARCH_EXHAUSTED_DETAIL, GLOBAL_SEARCH_EXHAUSTED_DETAIL)
+        )
+    
+    return user_id
+
+
+# Stores behind each browse source ("mixed" combines both)
+STORE_SERVICES = {"asos": asos_service, "amazon": amazon_service}
+
+
+def _start_store_fetches(prompt: str, gender: str, sources: List[str]) -> Dict[str, asyncio.Future]:
+    """
+    Start one browse per store that `sources` needs, in parallel.
+    
+    Each store is fetched once, sized for its largest consumer, so a batch
+    of e.g. amazon + mixed doesn't search and gender-filter Amazon twice.
+    """
+    num_per_store = {}
+    for source in sources:
+        stores = STORE_SERVICES if source == "mixed" else (source,)
+        for store in stores:
+            num_per_store[store] = max(
+                num_per_store.get(store, 0), BROWSE_SOURCE_CONFIG[source]["num_per_category"]
+            )
+    
+    return {
+        store: asyncio.ensure_future(STORE_SERVICES[store].browse_fashion(
+            prompt=prompt,
+            num_tops=num,
+            num_bottoms=num,
+            gender=gender
+        ))
+        for store, num in num_per_store.items()
+    }
+
+
+async def _fetch_mixed_products(store_fetches: Dict[str, asyncio.Future], num_per_category: int) -> Dict:
+    """Combine BOTH stores' results (fetched in parallel) and tag each product with its store"""
+    asos_result, amazon_result = await asyncio.gather(store_fetches["asos"], store_fetches["amazon"])
+    
+    # Combine products from both stores
+    all_tops = []
+    all_bottoms = []
+    
+    # Add ASOS products
+    for t in asos_result.get("tops", [])[:num_per_category]:
+        t["source"] = "asos"
+        all_tops.append(t)
+    for b in asos_result.get("bottoms", [])[:num_per_category]:
+        b["source"] = "asos"
+        all_bottoms.append(b)
+    
+    # Add Amazon products
+    for t in amazon_result.get("tops", [])[:num_per_category]:
+        t["source"] = "amazon"
+        all_tops.append(t)
+    for b in amazon_result.get("bottoms", [])[:num_per_category]:
+        b["source"] = "amazon"
+        all_bottoms.append(b)
+    
+    logger.info("📦 Combined: %d tops, %d bottoms from both stores", len(all_tops), len(all_bottoms))
+    
+    return {"tops": all_tops, "bottoms": all_bottoms}
+
+
+async def _browse_source(
+    source: str,
+    prompt: str,
+    gender: str,
+    user_id: str,
+    parse_task: Optional[asyncio.Future] = None,
+    store_fetches: Optional[Dict[str, asyncio.Future]] = None
+) -> OutfitResponse:
+    """
+    Browse outfits from one source (asos, amazon or mixed).
+    
+    Args:
+        source: Store to browse
+        prompt: User's outfit prompt
+        gender: Gender filter
+        user_id: Authenticated user (for logging)
+        parse_task: Shared prompt parse, so a multi-store browse parses once
+        store_fetches: Shared store fetches from _start_store_fetches (batch browse)
     """
+    config = BROWSE_SOURCE_CONFIG[source]
     start_time = time.time()
     
     try:
-        # Check authentication
-        user_id = await get_firebase_user(request)
-        if not user_id:
-            raise HTTPException(
-                status_code=401,
-                detail="Please sign in with Google to browse outfits."
-            )
+        logger.info("%s for user %s...: %s", config['log_label'], user_id[:8], prompt)
         
-        # Check usage limits (per-user AND global)
-        usage = get_user_usage(user_id)
-        if not usage["can_search"]:
-            if usage["search_exhausted"]:
-                raise HTTPException(
-                    status_code=429,
-                    detail="You've already used your 1 free search. Thank you for trying our app!"
-                )
-            else:
-                raise HTTPException(
-                    status_code=429,
-                    detail="Sorry, we've reached our search limit. Please try again later."
-                )
+        if not RAPIDAPI_CONFIGURED:
+            detail = "API not configured" if source == "mixed" else f"{config['store_name']} API not configured"
+            raise HTTPException(status_code=503, detail=detail)
         
-        # Increment usage (user + global)
-        if not increment_search(user_id):
-            raise HTTPException(status_code=429, detail="Unable to process. Please try again.")
+        if parse_task is None:
+            parse_task = llm_service.parse_outfit_prompt(prompt)
         
-        gender = prompt_request.gender or "women"
-        logger.info(f"🛍️ Browsing for user {user_id[:8]}...: {prompt_request.prompt}")
+        if store_fetches is None:
+            store_fetches = _start_store_fetches(prompt, gender, [source])
         
-        if not settings.RAPIDAPI_KEY:
-            raise HTTPException(status_code=503, detail="ASOS API not configured")
+        if source == "mixed":
+            fetch_task = _fetch_mixed_products(store_fetches, config["num_per_category"])
+        else:
+            fetch_task = store_fetches[source]
         
-        # Parse prompt with LLM
-        parsed_prompt = await llm_service.parse_outfit_prompt(prompt_request.prompt)
-        logger.info(f"✅ Parsed: {parsed_prompt.dict()}")
+        # Parse prompt with LLM and fetch products in parallel
+        parsed_prompt, result = await asyncio.gather(parse_task, fetch_task, return_exceptions=True)
         
-        # Fetch from ASOS
-        asos_result = await asos_service.browse_fashion(
-            prompt=prompt_request.prompt,
-            num_tops=5,
-            num_bottoms=5,
-            gender=gender
-        )
+        if isinstance(result, BaseException):
+            raise result
+        
+        # The parsed prompt is informational only, so a failed parse never fails the browse
+        if isinstance(parsed_prompt, BaseException):
+            logger.warning("Prompt parse failed, using keyword fallback: %s", parsed_prompt)
+            parsed_prompt = llm_service.fallback_parse(prompt)
+        else:
+            logger.debug("✅ Parsed: %s", parsed_prompt)
         
-        tops = asos_result["tops"]
-        bottoms = asos_result["bottoms"]
+        tops = result["tops"]
+        bottoms = result["bottoms"]
         
         if not tops or not bottoms:
-            raise HTTPException(status_code=404, detail="No matching products found")
+            raise HTTPException(status_code=404, detail=config["not_found"])
         
-        # Create product items
-        top_items = [
-            ProductItem(
-                id=t["id"], name=t["name"], category="top",
-                price=t["price"], currency=t["currency"],
-                image_url=t["image_url"], buy_url=t["buy_url"],
-                brand=t["brand"], description=t.get("description", ""),
-            )
-            for t in tops
-        ]
+        # Create product items (mixed results carry the store in the brand)
+        top_items = to_product_items(tops, tag_source=source == "mixed")
         
-        bottom_items = [
-            ProductItem(
-                id=b["id"], name=b["name"], category="bottom",
-                price=b["price"], currency=b["currency"],
-                image_url=b["image_url"], buy_url=b["buy_url"],
-                brand=b["brand"], description=b.get("description", ""),
-            )
-            for b in bottoms
-        ]
+        bottom_items = to_product_items(bottoms, tag_source=source == "mixed")
         
         # Create combinations (max 3) with LLM compatibility check
-        outfit_combinations = await product_service.create_outfit_combinations(
-            tops=top_items,
-            bottoms=bottom_items,
-            max_combinations=3,
-            user_prompt=prompt_request.prompt
-        )
+        if source == "mixed":
+            # Prioritize cross-store combos
+            outfit_combinations = await product_service.create_mixed_outfit_combinations(
+                tops=top_items,
+                bottoms=bottom_items,
+                max_combinations=3,
+                user_prompt=prompt
+            )
+        else:
+            outfit_combinations = await product_service.create_outfit_combinations(
+                tops=top_items,
+                bottoms=bottom_items,
+                max_combinations=3,
+                user_prompt=prompt
+            )
         
-        # Build response
+        # Build response (one timestamp for the whole batch)
+        generated_at = datetime.utcnow()
         generated_outfits = [
             GeneratedOutfit(
-                outfit_id=f"asos_{uuid.uuid4().hex[:8]}",
-                prompt=prompt_request.prompt,
+                outfit_id=f"{config['id_prefix']}_{secrets.token_hex(4)}",
+                prompt=prompt,
                 combination=combo,
                 tryon_image_url=None,
-                created_at=datetime.now()
+                generated_at=generated_at
             )
             for combo in outfit_combinations
         ]
         
         processing_time = time.time() - start_time
-        logger.info(f"✅ Found {len(generated_outfits)} outfits in {processing_time:.2f}s")
+        logger.info(
+            "✅ Found %d%s outfits in %.2fs", len(generated_outfits), config['found_label'], processing_time
+        )
+        
+        message = f"Found {len(generated_outfits)}{config['found_label']} outfits"
+        if source == "mixed":
+            message += " from ASOS + Amazon"
         
         return OutfitResponse(
             success=True,
-            message=f"Found {len(generated_outfits)} outfits",
+            message=message,
             outfits=generated_outfits,
             total_count=len(generated_outfits),
             processing_time=processing_time,
@@ -285,12 +560,33 @@ async def browse_outfits_asos(request: Request, prompt_request: OutfitPromptRequ
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"❌ Error: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
+        logger.exception("❌ %s Error: %s", config['store_name'], e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# ==================== BROWSE OUTFITS (ASOS) ====================
+
+@app.post(
+    f"{settings.API_PREFIX}/outfits/browse-asos",
+    response_model=OutfitResponse,
+    tags=["Outfits"],
+    summary="Browse outfits from ASOS"
+)
+@limiter.limit("20/minute")
+@idempotent(ttl=IDEMPOTENCY_TTL)
+async def browse_outfits_asos(request: Request, prompt_request: OutfitPromptRequest):
+    """
+    Browse outfit combinations from ASOS
+    
+    - Requires Google sign-in
+    - Limited to 2 searches per 5 days
+    - Returns 3 outfit combinations per search
+    """
+    user_id = await authorize_search(request)
+    gender = prompt_request.gender or "women"
+    return model_response(await _browse_source("asos", prompt_request.prompt, gender, user_id))
+
+
 # ==================== BROWSE OUTFITS (AMAZON) ====================
 
 @app.post(
@@ -300,6 +596,7 @@ async def browse_outfits_asos(request: Request, prompt_request: OutfitPromptRequ
     summary="Browse outfits from Amazon"
 )
 @limiter.limit("20/minute")
+@idempotent(ttl=IDEMPOTENCY_TTL)
 async def browse_outfits_amazon(request: Request, prompt_request: OutfitPromptRequest):
     """
     Browse outfit combinations from Amazon
@@ -308,119 +605,9 @@ async def browse_outfits_amazon(request: Request, prompt_request: OutfitPromptRe
     - Limited to 1 search per user (lifetime)
     - Returns 3 outfit combinations per search
     """
-    start_time = time.time()
-    
-    try:
-        # Check authentication
-        user_id = await get_firebase_user(request)
-        if not user_id:
-            raise HTTPException(
-                status_code=401,
-                detail="Please sign in with Google to browse outfits."
-            )
-        
-        # Check usage limits (per-user AND global)
-        usage = get_user_usage(user_id)
-        if not usage["can_search"]:
-            if usage["search_exhausted"]:
-                raise HTTPException(
-                    status_code=429,
-                    detail="You've already used your 1 free search. Thank you for trying our app!"
-                )
-            else:
-                raise HTTPException(
-                    status_code=429,
-                    detail="Sorry, we've reached our search limit. Please try again later."
-                )
-        
-        # Increment usage (user + global)
-        if not increment_search(user_id):
-            raise HTTPException(status_code=429, detail="Unable to process. Please try again.")
-        
-        gender = prompt_request.gender or "women"
-        logger.info(f"🛒 Amazon browse for user {user_id[:8]}...: {prompt_request.prompt}")
-        
-        if not settings.RAPIDAPI_KEY:
-            raise HTTPException(status_code=503, detail="Amazon API not configured")
-        
-        # Parse prompt with LLM
-        parsed_prompt = await llm_service.parse_outfit_prompt(prompt_request.prompt)
-        logger.info(f"✅ Parsed: {parsed_prompt.dict()}")
-        
-        # Fetch from Amazon
-        amazon_result = await amazon_service.browse_fashion(
-            prompt=prompt_request.prompt,
-            num_tops=5,
-            num_bottoms=5,
-            gender=gender
-        )
-        
-        tops = amazon_result["tops"]
-        bottoms = amazon_result["bottoms"]
-        
-        if not tops or not bottoms:
-            raise HTTPException(status_code=404, detail="No matching products found on Amazon")
-        
-        # Create product items
-        top_items = [
-            ProductItem(
-                id=t["id"], name=t["name"], category="top",
-                price=t["price"], currency=t["currency"],
-                image_url=t["image_url"], buy_url=t["buy_url"],
-                brand=t["brand"], description=t.get("description", ""),
-            )
-            for t in tops
-        ]
-        
-        bottom_items = [
-            ProductItem(
-                id=b["id"], name=b["name"], category="bottom",
-                price=b["price"], currency=b["currency"],
-                image_url=b["image_url"], buy_url=b["buy_url"],
-                brand=b["brand"], description=b.get("description", ""),
-            )
-            for b in bottoms
-        ]
-        
-        # Create combinations (max 3) with LLM compatibility check
-        outfit_combinations = await product_service.create_outfit_combinations(
-            tops=top_items,
-            bottoms=bottom_items,
-            max_combinations=3,
-            user_prompt=prompt_request.prompt
-        )
-        
-        # Build response
-        generated_outfits = [
-            GeneratedOutfit(
-                outfit_id=f"amz_{uuid.uuid4().hex[:8]}",
-                prompt=prompt_request.prompt,
-                combination=combo,
-                tryon_image_url=None,
-                created_at=datetime.now()
-            )
-            for combo in outfit_combinations
-        ]
-        
-        processing_time = time.time() - start_time
-        logger.info(f"✅ Found {len(generated_outfits)} Amazon outfits in {processing_time:.2f}s")
-        
-        return OutfitResponse(
-            success=True,
-            message=f"Found {len(generated_outfits)} Amazon outfits",
-            outfits=generated_outfits,
-            total_count=len(generated_outfits),
-            processing_time=processing_time,
-            parsed_prompt=parsed_prompt
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"❌ Amazon Error: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=str(e))
+    user_id = await authorize_search(request)
+    gender = prompt_request.gender or "women"
+    return model_response(await _browse_source("amazon", prompt_request.prompt, gender, user_id))
 
 
 # ==================== BROWSE OUTFITS (MIXED STORES) ====================
@@ -432,6 +619,7 @@ async def browse_outfits_amazon(request: Request, prompt_request: OutfitPromptRe
     summary="Browse outfits from multiple stores (mixed combinations)"
 )
 @limiter.limit("20/minute")
+@idempotent(ttl=IDEMPOTENCY_TTL)
 async def browse_outfits_mixed(request: Request, prompt_request: OutfitPromptRequest):
     """
     Browse outfit combinations from ALL stores (ASOS + Amazon)
@@ -441,149 +629,117 @@ async def browse_outfits_mixed(request: Request, prompt_request: OutfitPromptReq
     - Limited to 1 search per user (lifetime)
     - Returns 3 outfit combinations per search
     """
+    user_id = await authorize_search(request)
+    gender = prompt_request.gender or "women"
+    return model_response(await _browse_source("mixed", prompt_request.prompt, gender, user_id))
+
+
+# ==================== BROWSE OUTFITS (BATCH) ====================
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+async def _stream_browse_results(
+    prompt: str,
+    gender: str,
+    user_id: str,
+    sources: List[str],
+    parse_task: Optional[asyncio.Future],
+    store_fetches: Optional[Dict[str, asyncio.Future]],
+    start_time: float
+):
+    """Yield one NDJSON line per source as it finishes, then a summary line"""
+    async def browse(source: str):
+        try:
+            return source, await _browse_source(source, prompt, gender, user_id, parse_task, store_fetches), None
+        except HTTPException as e:
+            return source, None, e.detail
+        except Exception as e:
+            return source, None, str(e)
+    
+    succeeded = 0
+    for next_done in asyncio.as_completed([browse(s) for s in sources]):
+        source, result, error = await next_done
+        if error is None:
+            succeeded += 1
+            line = {"source": source, "result": result.model_dump(mode="json")}
+        else:
+            line = {"source": source, "error": error}
+        yield orjson.dumps(line) + b"\n"
+    
+    yield orjson.dumps({
+        "done": True,
+        "success": succeeded > 0,
+        "processing_time": time.time() - start_time
+    }) + b"\n"
+
+
+@app.post(
+    f"{settings.API_PREFIX}/outfits/browse",
+    response_model=BatchBrowseResponse,
+    responses={200: {"content": {NDJSON_MEDIA_TYPE: {}}}},
+    tags=["Outfits"],
+    summary="Browse outfits from several stores in one request"
+)
+@limiter.limit("20/minute")
+@idempotent(ttl=IDEMPOTENCY_TTL)
+async def browse_outfits_batch(request: Request, browse_request: BatchBrowseRequest):
+    """
+    Browse outfit combinations from several sources at once
+    
+    - Requires Google sign-in
+    - Counts as a single search (one auth + usage check for all sources)
+    - Returns 3 outfit combinations per source, keyed by source
+    - With `Accept: application/x-ndjson`, streams one line per source as it
+      finishes (`{"source", "result"}` or `{"source", "error"}`), then a
+      final `{"done": true, ...}` line
+    """
     start_time = time.time()
     
-    try:
-        # Check authentication
-        user_id = await get_firebase_user(request)
-        if not user_id:
-            raise HTTPException(
-                status_code=401,
-                detail="Please sign in with Google to browse outfits."
-            )
-        
-        # Check usage limits (per-user AND global)
-        usage = get_user_usage(user_id)
-        if not usage["can_search"]:
-            if usage["search_exhausted"]:
-                raise HTTPException(
-                    status_code=429,
-                    detail="You've already used your 1 free search. Thank you for trying our app!"
-                )
-            else:
-                raise HTTPException(
-                    status_code=429,
-                    detail="Sorry, we've reached our search limit. Please try again later."
-                )
-        
-        # Increment usage (user + global)
-        if not increment_search(user_id):
-            raise HTTPException(status_code=429, detail="Unable to process. Please try again.")
-        
-        gender = prompt_request.gender or "women"
-        logger.info(f"🔀 Mixed store browse for user {user_id[:8]}...: {prompt_request.prompt}")
-        
-        if not settings.RAPIDAPI_KEY:
-            raise HTTPException(status_code=503, detail="API not configured")
-        
-        # Parse prompt with LLM
-        parsed_prompt = await llm_service.parse_outfit_prompt(prompt_request.prompt)
-        logger.info(f"✅ Parsed: {parsed_prompt.dict()}")
-        
-        # Fetch from BOTH stores in parallel
-        import asyncio
-        asos_task = asos_service.browse_fashion(
-            prompt=prompt_request.prompt,
-            num_tops=3,
-            num_bottoms=3,
-            gender=gender
-        )
-        amazon_task = amazon_service.browse_fashion(
-            prompt=prompt_request.prompt,
-            num_tops=3,
-            num_bottoms=3,
-            gender=gender
-        )
-        
-        asos_result, amazon_result = await asyncio.gather(asos_task, amazon_task)
-        
-        # Combine products from both stores
-        all_tops = []
-        all_bottoms = []
-        
-        # Add ASOS products
-        for t in asos_result.get("tops", []):
-            t["source"] = "asos"
-            all_tops.append(t)
-        for b in asos_result.get("bottoms", []):
-            b["source"] = "asos"
-            all_bottoms.append(b)
-        
-        # Add Amazon products
-        for t in amazon_result.get("tops", []):
-            t["source"] = "amazon"
-            all_tops.append(t)
-        for b in amazon_result.get("bottoms", []):
-            b["source"] = "amazon"
-            all_bottoms.append(b)
-        
-        logger.info(f"📦 Combined: {len(all_tops)} tops, {len(all_bottoms)} bottoms from both stores")
-        
-        if not all_tops or not all_bottoms:
-            raise HTTPException(status_code=404, detail="No matching products found")
-        
-        # Create product items with source info in brand
-        top_items = [
-            ProductItem(
-                id=t["id"], name=t["name"], category="top",
-                price=t["price"], currency=t.get("currency", "INR"),
-                image_url=t["image_url"], buy_url=t["buy_url"],
-                brand=f"{t.get('brand', 'Unknown')} ({t.get('source', 'unknown').upper()})",
-                description=t.get("description", ""),
-            )
-            for t in all_tops
-        ]
-        
-        bottom_items = [
-            ProductItem(
-                id=b["id"], name=b["name"], category="bottom",
-                price=b["price"], currency=b.get("currency", "INR"),
-                image_url=b["image_url"], buy_url=b["buy_url"],
-                brand=f"{b.get('brand', 'Unknown')} ({b.get('source', 'unknown').upper()})",
-                description=b.get("description", ""),
-            )
-            for b in all_bottoms
-        ]
-        
-        # Create MIXED combinations (max 3) - prioritize cross-store combos with LLM compatibility check
-        outfit_combinations = await product_service.create_mixed_outfit_combinations(
-            tops=top_items,
-            bottoms=bottom_items,
-            max_combinations=3,
-            user_prompt=prompt_request.prompt
-        )
-        
-        # Build response
-        generated_outfits = [
-            GeneratedOutfit(
-                outfit_id=f"mix_{uuid.uuid4().hex[:8]}",
-                prompt=prompt_request.prompt,
-                combination=combo,
-                tryon_image_url=None,
-                created_at=datetime.now()
-            )
-            for combo in outfit_combinations
-        ]
-        
-        processing_time = time.time() - start_time
-        logger.info(f"✅ Found {len(generated_outfits)} mixed outfits in {processing_time:.2f}s")
-        
-        return OutfitResponse(
-            success=True,
-            message=f"Found {len(generated_outfits)} mixed outfits from ASOS + Amazon",
-            outfits=generated_outfits,
-            total_count=len(generated_outfits),
-            processing_time=processing_time,
-            parsed_prompt=parsed_prompt
+    user_id = await authorize_search(request)
+    gender = browse_request.gender or "women"
+    sources = list(dict.fromkeys(s.value for s in browse_request.sources))
+    
+    # Parse the prompt once and fetch each store once, shared across sources
+    # (unconfigured stores fail fast, so nothing would await either)
+    parse_task = None
+    store_fetches = None
+    if RAPIDAPI_CONFIGURED:
+        parse_task = asyncio.ensure_future(llm_service.parse_outfit_prompt(browse_request.prompt))
+        store_fetches = _start_store_fetches(browse_request.prompt, gender, sources)
+    
+    if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        return StreamingResponse(
+            _stream_browse_results(
+                browse_request.prompt, gender, user_id, sources, parse_task, store_fetches, start_time
+            ),
+            media_type=NDJSON_MEDIA_TYPE,
+            # GZipMiddleware would hold lines back in its buffer; it skips encoded responses
+            headers={"Content-Encoding": "identity"}
         )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"❌ Mixed Store Error: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=str(e))
+    
+    results = await asyncio.gather(
+        *(_browse_source(s, browse_request.prompt, gender, user_id, parse_task, store_fetches) for s in sources),
+        return_exceptions=True
+    )
+    
+    # One failing store shouldn't fail the others
+    outfit_results = {}
+    errors = {}
+    for source, result in zip(sources, results):
+        if isinstance(result, HTTPException):
+            errors[source] = result.detail
+        elif isinstance(result, Exception):
+            errors[source] = str(result)
+        else:
+            outfit_results[source] = result
+    
+    return model_response(BatchBrowseResponse(
+        success=bool(outfit_results),
+        results=outfit_results,
+        errors=errors,
+        processing_time=time.time() - start_time
+    ))
 
 
 # ==================== VIRTUAL TRY-ON ====================
@@ -600,6 +756,155 @@ class TryOnResponse(BaseModel):
     tryon_image_url: str
     processing_time: float
 
+class TryOnJobResponse(BaseModel):
+    job_id: str
+    status: str  # queued | processing | completed | failed
+    status_url: str
+    result: Optional[TryOnResponse] = None
+    error: Optional[str] = None
+
+def _compose_fallback_preview(top_img, bottom_img):
+    """Build the outfit preview card used when the AI try-on fails"""
+    if top_img.mode == 'RGBA':
+        top_img = top_img.convert('RGB')
+    if bottom_img.mode == 'RGBA':
+        bottom_img = bottom_img.convert('RGB')
+    return tryon_service.create_outfit_preview(top_img, bottom_img)
+
+
+async def authorize_tryon(request: Request) -> str:
+    """
+    Authenticate the caller and consume one try-on.
+    
+    Raises:
+        HTTPException: 401 if not signed in, 429 if the try-on limit is reached
+    """
+    # Fail fast once the global quota is used up (skips the per-user lookups)
+    if not get_global_usage_cached()["tryons_available"]:
+        raise HTTPException(
+            status_code=429,
+            detail=GLOBAL_TRYON_EXHAUSTED_DETAIL
+        )
+    
+    # Check authentication
+    user_id = await get_firebase_user(request)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Please sign in to use try-on")
+    
+    # Check usage limits (per-user AND global) and increment in one transaction
+    result = check_and_increment_tryon(user_id)
+    if not result["allowed"]:
+        raise HTTPException(
+            status_code=429,
+            detail=_limit_detail(result["reason"], TRYON_EXHAUSTED_DETAIL, GLOBAL_TRYON_EXHAUSTED_DETAIL)
+        )
+    
+    return user_id
+
+
+async def _run_tryon(
+    user_id: str,
+    model_url: str,
+    top_image_url: str,
+    bottom_image_url: str,
+    start_time: float
+) -> TryOnResponse:
+    """Generate the try-on image (with preview fallback) for resolved garment URLs"""
+    logger.info("🎨 Generating try-on for user %s...", user_id[:8])
+    
+    # Generate try-on
+    result_image = await tryon_service.generate_full_outfit_tryon(
+        model_image_url=model_url,
+        top_image_url=top_image_url,
+        bottom_image_url=bottom_image_url
+    )
+    
+    # Fallback if AI fails
+    if not result_image:
+        logger.warning("⚠️ AI try-on failed, using fallback...")
+        from app.services.garment_extractor import garment_extractor
+        top_img, bottom_img = await asyncio.gather(
+            garment_extractor.download_image(top_image_url),
+            garment_extractor.download_image(bottom_image_url),
+        )
+        
+        if top_img and bottom_img:
+            # PIL work runs in a worker thread so the event loop stays free
+            result_image = await asyncio.to_thread(_compose_fallback_preview, top_img, bottom_img)
+        else:
+            raise HTTPException(status_code=503, detail="Unable to process images")
+    
+    # PNG encode + base64 of the full-size result is CPU heavy
+    tryon_url = await asyncio.to_thread(tryon_service.image_to_data_url, result_image)
+    processing_time = time.time() - start_time
+    
+    logger.info("✅ Try-on generated in %.2fs", processing_time)
+    
+    return TryOnResponse(
+        success=True,
+        tryon_image_url=tryon_url,
+        processing_time=processing_time
+    )
+
+
+async def _decode_upload(file: Optional[UploadFile], label: str) -> Optional[Image.Image]:
+    """
+    Decode an uploaded garment image (None if no file was sent)
+    
+    Raises:
+        HTTPException: 400 if the file isn't a readable image
+    """
+    if not file:
+        return None
+    
+    from app.services.garment_extractor import decode_image
+    
+    data = await file.read()
+    try:
+        # Full decode off the event loop, so corrupt files fail here
+        return await asyncio.to_thread(decode_image, data)
+    except Exception as e:
+        logger.warning("Invalid %s upload: %s", label, e)
+        raise HTTPException(status_code=400, detail=f"Invalid {label} image file")
+
+
+async def _resolve_garment(image: Optional[Image.Image], url: Optional[str], folder: str) -> str:
+    """Cloudinary URL for a garment sent as a file, else the given URL"""
+    if image is None:
+        return url
+    
+    return await tryon_service._upload_to_cloudinary(image, folder)
+
+
+async def _resolve_base64_garment(image_base64: Optional[str], url: Optional[str], folder: str) -> str:
+    """Cloudinary URL for a garment sent as base64, else the given URL"""
+    if not image_base64:
+        return url
+    
+    image = await asyncio.to_thread(tryon_service.base64_to_image, image_base64)
+    return await tryon_service._upload_to_cloudinary(image, folder)
+
+
+async def _run_tryon_request(user_id: str, tryon_request: TryOnRequest, start_time: float) -> TryOnResponse:
+    """Resolve the garments of a JSON try-on request and generate the try-on"""
+    # Get model image
+    model_url = tryon_request.model_image_url or DEFAULT_MODEL_IMAGE_URL
+    
+    # Process images (base64 preferred, fallback to URL)
+    if not tryon_request.top_image_base64 and not tryon_request.top_image_url:
+        raise HTTPException(status_code=400, detail="No top image provided")
+    if not tryon_request.bottom_image_base64 and not tryon_request.bottom_image_url:
+        raise HTTPException(status_code=400, detail="No bottom image provided")
+    
+    # Decode and upload both garments in parallel, off the event loop
+    top_image_url, bottom_image_url = await asyncio.gather(
+        _resolve_base64_garment(tryon_request.top_image_base64, tryon_request.top_image_url, "tryon_top"),
+        _resolve_base64_garment(tryon_request.bottom_image_base64, tryon_request.bottom_image_url, "tryon_bottom"),
+    )
+    
+    return await _run_tryon(user_id, model_url, top_image_url, bottom_image_url, start_time)
+
+
 @app.post(
     f"{settings.API_PREFIX}/outfits/tryon",
     response_model=TryOnResponse,
@@ -607,6 +912,7 @@ class TryOnResponse(BaseModel):
     summary="Generate virtual try-on"
 )
 @limiter.limit("5/minute")
+@idempotent(ttl=IDEMPOTENCY_TTL)
 async def generate_tryon(request: Request, tryon_request: TryOnRequest):
     """
     Generate virtual try-on for an outfit
@@ -617,97 +923,147 @@ async def generate_tryon(request: Request, tryon_request: TryOnRequest):
     start_time = time.time()
     
     try:
-        # Check authentication
-        user_id = await get_firebase_user(request)
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Please sign in to use try-on")
+        user_id = await authorize_tryon(request)
+        return await _run_tryon_request(user_id, tryon_request, start_time)
         
-        # Check usage limits (per-user AND global)
-        usage = get_user_usage(user_id)
-        if not usage["can_tryon"]:
-            if usage["tryon_exhausted"]:
-                raise HTTPException(
-                    status_code=429,
-                    detail="You've already used your 1 free virtual try-on. Thank you for trying our app!"
-                )
-            else:
-                raise HTTPException(
-                    status_code=429,
-                    detail="Sorry, we've reached our try-on limit. Please try again later."
-                )
-        
-        # Increment usage (user + global)
-        if not increment_tryon(user_id):
-            raise HTTPException(status_code=429, detail="Unable to process. Please try again.")
-        
-        # Get model image
-        model_url = tryon_request.model_image_url or settings.MODEL_IMAGE_URL
-        
-        # Process images (base64 preferred, fallback to URL)
-        top_image_url = None
-        bottom_image_url = None
-        
-        if tryon_request.top_image_base64:
-            top_pil = tryon_service.base64_to_image(tryon_request.top_image_base64)
-            top_image_url = await tryon_service._upload_to_cloudinary(top_pil, "tryon_top")
-        elif tryon_request.top_image_url:
-            top_image_url = tryon_request.top_image_url
-        else:
-            raise HTTPException(status_code=400, detail="No top image provided")
-        
-        if tryon_request.bottom_image_base64:
-            bottom_pil = tryon_service.base64_to_image(tryon_request.bottom_image_base64)
-            bottom_image_url = await tryon_service._upload_to_cloudinary(bottom_pil, "tryon_bottom")
-        elif tryon_request.bottom_image_url:
-            bottom_image_url = tryon_request.bottom_image_url
-        else:
-            raise HTTPException(status_code=400, detail="No bottom image provided")
-        
-        logger.info(f"🎨 Generating try-on for user {user_id[:8]}...")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("❌ Error: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post(
+    f"{settings.API_PREFIX}/outfits/tryon/upload",
+    response_model=TryOnResponse,
+    tags=["Outfits"],
+    summary="Generate virtual try-on from uploaded garment images"
+)
+@limiter.limit("5/minute")
+@idempotent(ttl=IDEMPOTENCY_TTL)
+async def generate_tryon_multipart(
+    request: Request,
+    top: Optional[UploadFile] = File(None),
+    bottom: Optional[UploadFile] = File(None),
+    top_url: Optional[str] = Form(None),
+    bottom_url: Optional[str] = Form(None),
+    model_url: Optional[str] = Form(None),
+):
+    """
+    Generate virtual try-on with garments sent as multipart files
+    
+    Same as /outfits/tryon, but images are raw file parts instead of
+    base64 strings in JSON (smaller uploads, no base64 decode).
+    
+    - Requires Google sign-in
+    - Limited to 1 try-on per 5 days
+    """
+    start_time = time.time()
+    
+    if not top and not top_url:
+        raise HTTPException(status_code=400, detail="No top image provided")
+    if not bottom and not bottom_url:
+        raise HTTPException(status_code=400, detail="No bottom image provided")
+    
+    # Reject unreadable files before a try-on is counted
+    top_image, bottom_image = await asyncio.gather(
+        _decode_upload(top, "top"),
+        _decode_upload(bottom, "bottom"),
+    )
+    
+    try:
+        user_id = await authorize_tryon(request)
         
-        # Generate try-on
-        result_image = await tryon_service.generate_full_outfit_tryon(
-            model_image_url=model_url,
-            top_image_url=top_image_url,
-            bottom_image_url=bottom_image_url
+        # Upload whichever garments came in as files (in parallel; the upload
+        # helper encodes and uploads in a worker thread)
+        top_image_url, bottom_image_url = await asyncio.gather(
+            _resolve_garment(top_image, top_url, "tryon_top"),
+            _resolve_garment(bottom_image, bottom_url, "tryon_bottom"),
         )
         
-        # Fallback if AI fails
-        if not result_image:
-            logger.warning("⚠️ AI try-on failed, using fallback...")
-            from app.services.garment_extractor import garment_extractor
-            top_img = await garment_extractor.download_image(top_image_url)
-            bottom_img = await garment_extractor.download_image(bottom_image_url)
-            
-            if top_img and bottom_img:
-                if top_img.mode == 'RGBA':
-                    top_img = top_img.convert('RGB')
-                if bottom_img.mode == 'RGBA':
-                    bottom_img = bottom_img.convert('RGB')
-                result_image = tryon_service.create_outfit_preview(top_img, bottom_img)
-            else:
-                raise HTTPException(status_code=503, detail="Unable to process images")
-        
-        tryon_url = tryon_service.image_to_data_url(result_image)
-        processing_time = time.time() - start_time
-        
-        logger.info(f"✅ Try-on generated in {processing_time:.2f}s")
-        
-        return TryOnResponse(
-            success=True,
-            tryon_image_url=tryon_url,
-            processing_time=processing_time
+        return await _run_tryon(
+            user_id,
+            model_url or DEFAULT_MODEL_IMAGE_URL,
+            top_image_url,
+            bottom_image_url,
+            start_time
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"❌ Error: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
+        logger.exception("❌ Error: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# ==================== VIRTUAL TRY-ON (ASYNC JOBS) ====================
+
+def _tryon_job_response(job: Dict) -> TryOnJobResponse:
+    return TryOnJobResponse(
+        job_id=job["job_id"],
+        status=job["status"],
+        status_url=f"{settings.API_PREFIX}/outfits/tryon/jobs/{job['job_id']}",
+        result=job["result"],
+        error=job["error"]
+    )
+
+
+@app.post(
+    f"{settings.API_PREFIX}/outfits/tryon/jobs",
+    response_model=TryOnJobResponse,
+    status_code=202,
+    tags=["Outfits"],
+    summary="Queue a virtual try-on"
+)
+@limiter.limit("5/minute")
+@idempotent(ttl=IDEMPOTENCY_TTL)
+async def queue_tryon(request: Request, tryon_request: TryOnRequest):
+    """
+    Queue a virtual try-on and return right away (202 Accepted)
+    
+    Same input as /outfits/tryon. Poll `status_url` until the status is
+    `completed` (result holds the try-on) or `failed` (error holds the reason).
+    The try-on is counted when the job is queued.
+    
+    - Requires Google sign-in
+    - Limited to 1 try-on per 5 days
+    """
+    if not tryon_request.top_image_base64 and not tryon_request.top_image_url:
+        raise HTTPException(status_code=400, detail="No top image provided")
+    if not tryon_request.bottom_image_base64 and not tryon_request.bottom_image_url:
+        raise HTTPException(status_code=400, detail="No bottom image provided")
+    
+    user_id = await authorize_tryon(request)
+    start_time = time.time()
+    
+    job = tryon_jobs.submit(
+        lambda: _run_tryon_request(user_id, tryon_request, start_time),
+        owner=user_id
+    )
+    logger.info("📥 Queued try-on job %s for user %s", job["job_id"], user_id[:8])
+    return _tryon_job_response(job)
+
+
+@app.get(
+    f"{settings.API_PREFIX}/outfits/tryon/jobs/{{job_id}}",
+    response_model=TryOnJobResponse,
+    tags=["Outfits"],
+    summary="Get virtual try-on job status"
+)
+async def get_tryon_job(request: Request, job_id: str):
+    """Current status of a queued try-on (and its result once completed)"""
+    user_id = await get_firebase_user(request)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Please sign in to use try-on")
+    
+    # Other users' jobs look the same as unknown ones
+    job = tryon_jobs.get(job_id)
+    if not job or job["owner"] != user_id:
+        raise HTTPException(status_code=404, detail="Try-on job not found")
+    
+    return _tryon_job_response(job)
+
+
 # ==================== UPLOAD IMAGE ====================
 
 class UploadResponse(BaseModel):
@@ -727,25 +1083,27 @@ async def upload_model_image(file: UploadFile = File(...)):
         if not file.content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        content = await file.read()
-        public_id = f"user_models/user_{uuid.uuid4().hex[:12]}"
+        public_id = f"user_models/user_{secrets.token_hex(6)}"
         
-        result = cloudinary.uploader.upload(
-            io.BytesIO(content),
+        # Stream the spooled file to Cloudinary from a worker thread (the SDK is blocking)
+        await file.seek(0)
+        result = await asyncio.to_thread(
+            cloudinary.uploader.upload,
+            file.file,
             public_id=public_id,
             resource_type="image",
             overwrite=True
         )
         
         image_url = result.get('secure_url')
-        logger.info(f"✅ Uploaded: {image_url}")
+        logger.info("✅ Uploaded: %s", image_url)
         
         return UploadResponse(success=True, image_url=image_url, filename=public_id)
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"❌ Upload failed: {e}")
+        logger.error("❌ Upload failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -795,15 +1153,15 @@ async def admin_stats():
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={"success": False, "error": exc.detail, "error_code": exc.status_code}
     )
 
 @app.exception_handler(Exception)
 async def general_exception_handler(request, exc):
-    logger.error(f"Unhandled exception: {exc}")
-    return JSONResponse(
+    logger.error("Unhandled exception: %s", exc)
+    return ORJSONResponse(
         status_code=500,
         content={"success": False, "error": "Internal server error"}
     )
@@ -822,5 +1180,26 @@ async def root():
 
 
 if __name__ == "__main__":
+    import os
     import uvicorn
-    uvicorn.run("app.main:app", host=settings.API_HOST, port=settings.API_PORT, reload=settings.DEBUG)
+    
+    workers = None if settings.DEBUG else (settings.WORKERS or os.cpu_count())
+    if workers and workers > 1:
+        # Try-on jobs are tracked in process memory: a status poll landing on
+        # another worker would 404, breaking the 202 + polling flow
+        raise SystemExit(
+            f"WORKERS={settings.WORKERS} is not supported: the try-on job queue is "
+            "in-process, so run a single worker (WORKERS=1)"
+        )
+    
+    # loop/http "auto" pick uvloop + httptools (uvicorn[standard]) where available
+    # and fall back to asyncio + h11 elsewhere (e.g. Windows)
+    uvicorn.run(
+        "app.main:app",
+        host=settings.API_HOST,
+        port=settings.API_PORT,
+        reload=settings.DEBUG,
+        workers=workers,
+        loop="auto",
+        http="auto",
+    )
@@ -2,10 +2,121 @@
 Data models for AI Outfit App
 Pydantic models for API requests/responses and SQLAlchemy models for database
 """
-from pydantic import BaseModel, Field, HttpUrl
-from typing import Optional, List, Dict, Any
+from pydantic import AfterValidator, BaseModel, ConfigDict, Field
+from typing import Annotated, Optional, List, Dict, Any
 from datetime import datetime
 from enum import Enum
+import re
+
+
+# ==================== FIELD TYPES ====================
+
+_HTTP_URL_RE = re.compile(r"^https?://[^\s/?#]+\S*$", re.IGNORECASE)
+
+
+def _check_http_url(value: str) -> str:
+    """Cheap http(s) URL check (HttpUrl's full parse + IDNA is overkill for store URLs)"""
+    if not _HTTP_URL_RE.match(value):
+        raise ValueError("URL must start with http:// or https://")
+    return value
+
+
+# Plain str in responses (no Url object to convert back), checked with one regex
+WebUrl = Annotated[str, AfterValidator(_check_http_url)]
+
+
+# ==================== SCHEMA EXAMPLES ====================
+# Example payloads shown in the OpenAPI docs
+
+OUTFIT_PROMPT_EXAMPLE = {
+    "prompt": "Beach party, colorful and relaxed",
+    "max_price": 5000,
+    "preferred_brands": ["Zara", "H&M"]
+}
+
+USER_FEEDBACK_EXAMPLE = {
+    "outfit_id": "outfit_123456",
+    "action": "like",
+    "user_id": "user_789"
+}
+
+BATCH_BROWSE_REQUEST_EXAMPLE = {
+    "prompt": "Beach party, colorful and relaxed",
+    "gender": "women",
+    "sources": ["asos", "amazon", "mixed"]
+}
+
+PRODUCT_ITEM_EXAMPLE = {
+    "id": "prod_123",
+    "name": "Floral Beach Shirt",
+    "category": "top",
+    "price": 1299.00,
+    "currency": "INR",
+    "image_url": "https://example.com/shirt.jpg",
+    "buy_url": "https://example.com/buy/shirt",
+    "brand": "Zara",
+    "colors": ["blue", "white"],
+    "sizes": ["S", "M", "L"]
+}
+
+GENERATED_OUTFIT_EXAMPLE = {
+    "outfit_id": "outfit_abc123",
+    "combination": {
+        "top": {"id": "top_1", "name": "Beach Shirt", "category": "top", "price": 1299, "image_url": "...", "buy_url": "..."},
+        "bottom": {"id": "bottom_1", "name": "Shorts", "category": "bottom", "price": 899, "image_url": "...", "buy_url": "..."},
+        "total_price": 2198,
+        "match_score": 0.92,
+        "style_tags": ["casual", "beach", "summer"]
+    },
+    "tryon_image_url": "https://cloudinary.com/outfit_abc123.jpg",
+    "prompt": "Beach party, colorful relaxed",
+    "generated_at": "2024-01-15T10:30:00"
+}
+
+OUTFIT_RESPONSE_EXAMPLE = {
+    "success": True,
+    "message": "Generated 3 outfits",
+    "outfits": [],
+    "total_count": 3,
+    "processing_time": 5.2
+}
+
+BATCH_BROWSE_RESPONSE_EXAMPLE = {
+    "success": True,
+    "results": {"asos": {"success": True, "outfits": [], "total_count": 3, "processing_time": 4.1}},
+    "errors": {"amazon": "No matching products found on Amazon"},
+    "processing_time": 5.2
+}
+
+PARSED_PROMPT_EXAMPLE = {
+    "original_prompt": "Beach party, colorful relaxed",
+    "mood": "relaxed",
+    "location": "beach",
+    "occasion": "party",
+    "style": "casual",
+    "colors": ["colorful", "bright"],
+    "season": "summer",
+    "formality": "casual",
+    "keywords": ["beach", "party", "colorful", "relaxed"]
+}
+
+ERROR_RESPONSE_EXAMPLE = {
+    "success": False,
+    "error": "Failed to generate outfit",
+    "detail": "No matching products found for prompt",
+    "error_code": "NO_MATCHES"
+}
+
+HEALTH_CHECK_EXAMPLE = {
+    "status": "healthy",
+    "version": "1.0.0",
+    "timestamp": "2024-01-15T10:30:00",
+    "services": {
+        "database": "connected",
+        "llama": "running",
+        "runpod": "available"
+    }
+}
 
 
 # ==================== ENUMS ====================
@@ -36,6 +147,13 @@ class UserAction(str, Enum):
     SKIP = "skip"
 
 
+class BrowseSource(str, Enum):
+    """Stores that outfits can be browsed from"""
+    ASOS = "asos"
+    AMAZON = "amazon"
+    MIXED = "mixed"
+
+
 # ==================== REQUEST MODELS ====================
 
 class OutfitPromptRequest(BaseModel):
@@ -48,14 +166,7 @@ class OutfitPromptRequest(BaseModel):
     exclude_categories: Optional[List[ClothingCategory]] = Field(None, description="Categories to exclude")
     gender: Optional[str] = Field("women", description="Gender filter: 'men' or 'women'")
     
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "prompt": "Beach party, colorful and relaxed",
-                "max_price": 5000,
-                "preferred_brands": ["Zara", "H&M"]
-            }
-        }
+    model_config = ConfigDict(json_schema_extra={"example": OUTFIT_PROMPT_EXAMPLE})
 
 
 class UserFeedbackRequest(BaseModel):
@@ -64,14 +175,18 @@ class UserFeedbackRequest(BaseModel):
     action: UserAction = Field(..., description="User action: like/dislike/skip")
     user_id: Optional[str] = Field(None, description="Optional user ID for tracking")
     
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "outfit_id": "outfit_123456",
-                "action": "like",
-                "user_id": "user_789"
-            }
-        }
+    model_config = ConfigDict(json_schema_extra={"example": USER_FEEDBACK_EXAMPLE})
+
+
+class BatchBrowseRequest(OutfitPromptRequest):
+    """Request model for browsing several stores in one call"""
+    sources: List[BrowseSource] = Field(
+        default_factory=lambda: list(BrowseSource),
+        min_length=1,
+        description="Stores to browse: asos, amazon and/or mixed"
+    )
+    
+    model_config = ConfigDict(json_schema_extra={"example": BATCH_BROWSE_REQUEST_EXAMPLE})
 
 
 # ==================== RESPONSE MODELS ====================
@@ -83,28 +198,14 @@ class ProductItem(BaseModel):
     category: ClothingCategory = Field(..., description="Product category")
     price: float = Field(..., ge=0, description="Product price")
     currency: str = Field(default="INR", description="Currency code")
-    image_url: HttpUrl = Field(..., description="Product image URL")
-    buy_url: HttpUrl = Field(..., description="Purchase URL")
+    image_url: WebUrl = Field(..., description="Product image URL")
+    buy_url: WebUrl = Field(..., description="Purchase URL")
     brand: Optional[str] = Field(None, description="Brand name")
     description: Optional[str] = Field(None, description="Product description")
     colors: Optional[List[str]] = Field(None, description="Available colors")
     sizes: Optional[List[str]] = Field(None, description="Available sizes")
     
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "id": "prod_123",
-                "name": "Floral Beach Shirt",
-                "category": "top",
-                "price": 1299.00,
-                "currency": "INR",
-                "image_url": "https://example.com/shirt.jpg",
-                "buy_url": "https://example.com/buy/shirt",
-                "brand": "Zara",
-                "colors": ["blue", "white"],
-                "sizes": ["S", "M", "L"]
-            }
-        }
+    model_config = ConfigDict(json_schema_extra={"example": PRODUCT_ITEM_EXAMPLE})
 
 
 class OutfitCombination(BaseModel):
@@ -124,22 +225,7 @@ class GeneratedOutfit(BaseModel):
     prompt: str = Field(..., description="Original user prompt")
     generated_at: datetime = Field(default_factory=datetime.utcnow)
     
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "outfit_id": "outfit_abc123",
-                "combination": {
-                    "top": {"id": "top_1", "name": "Beach Shirt", "category": "top", "price": 1299, "image_url": "...", "buy_url": "..."},
-                    "bottom": {"id": "bottom_1", "name": "Shorts", "category": "bottom", "price": 899, "image_url": "...", "buy_url": "..."},
-                    "total_price": 2198,
-                    "match_score": 0.92,
-                    "style_tags": ["casual", "beach", "summer"]
-                },
-                "tryon_image_url": "https://cloudinary.com/outfit_abc123.jpg",
-                "prompt": "Beach party, colorful relaxed",
-                "generated_at": "2024-01-15T10:30:00"
-            }
-        }
+    model_config = ConfigDict(json_schema_extra={"example": GENERATED_OUTFIT_EXAMPLE})
 
 
 class OutfitResponse(BaseModel):
@@ -150,16 +236,17 @@ class OutfitResponse(BaseModel):
     total_count: int = Field(..., ge=0)
     processing_time: float = Field(..., ge=0, description="Time taken in seconds")
     
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "success": True,
-                "message": "Generated 3 outfits",
-                "outfits": [],
-                "total_count": 3,
-                "processing_time": 5.2
-            }
-        }
+    model_config = ConfigDict(json_schema_extra={"example": OUTFIT_RESPONSE_EXAMPLE})
+
+
+class BatchBrowseResponse(BaseModel):
+    """API response for a multi-store browse"""
+    success: bool = Field(default=True)
+    results: Dict[str, OutfitResponse] = Field(default_factory=dict, description="Outfits per store")
+    errors: Dict[str, str] = Field(default_factory=dict, description="Error message per failed store")
+    processing_time: float = Field(..., ge=0, description="Time taken in seconds")
+    
+    model_config = ConfigDict(json_schema_extra={"example": BATCH_BROWSE_RESPONSE_EXAMPLE})
 
 
 # ==================== INTERNAL MODELS ====================
@@ -178,20 +265,7 @@ class ParsedPrompt(BaseModel):
     # Extracted filters
     keywords: List[str] = Field(default_factory=list)
     
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "original_prompt": "Beach party, colorful relaxed",
-                "mood": "relaxed",
-                "location": "beach",
-                "occasion": "party",
-                "style": "casual",
-                "colors": ["colorful", "bright"],
-                "season": "summer",
-                "formality": "casual",
-                "keywords": ["beach", "party", "colorful", "relaxed"]
-            }
-        }
+    model_config = ConfigDict(json_schema_extra={"example": PARSED_PROMPT_EXAMPLE})
 
 
 class ProductEmbedding(BaseModel):
@@ -210,15 +284,7 @@ class ErrorResponse(BaseModel):
     detail: Optional[str] = Field(None, description="Detailed error info")
     error_code: Optional[str] = Field(None, description="Error code for debugging")
     
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "success": False,
-                "error": "Failed to generate outfit",
-                "detail": "No matching products found for prompt",
-                "error_code": "NO_MATCHES"
-            }
-        }
+    model_config = ConfigDict(json_schema_extra={"example": ERROR_RESPONSE_EXAMPLE})
 
 
 # ==================== HEALTH CHECK ====================
@@ -230,16 +296,4 @@ class HealthCheck(BaseModel):
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     services: Dict[str, str] = Field(default_factory=dict)
     
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "status": "healthy",
-                "version": "1.0.0",
-                "timestamp": "2024-01-15T10:30:00",
-                "services": {
-                    "database": "connected",
-                    "llama": "running",
-                    "runpod": "available"
-                }
-            }
-        }
+    model_config = ConfigDict(json_schema_extra={"example": HEALTH_CHECK_EXAMPLE})
@@ -5,14 +5,32 @@ API: https://rapidapi.com/letscrape-6bRBa3QguO5/api/real-time-amazon-data
 
 Subscribe at: https://rapidapi.com/letscrape-6bRBa3QguO5/api/real-time-amazon-data
 """
+import asyncio
 import httpx
+import orjson
 import logging
-from typing import List, Dict
+import re
+from typing import List, Dict, Optional
 from app.config import settings
-from app.services.llm_service import llm_service
+from app.services.cache import AsyncTTLCache
+from app.services.llm_service import llm_service, names_other_gender
 
 logger = logging.getLogger(__name__)
 
+# Pooled connections to RapidAPI (keep-alive skips the TLS handshake per search)
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+
+# Max in-flight RapidAPI searches per process (bursts queue instead of hitting 429s)
+RAPIDAPI_MAX_CONCURRENCY = 8
+
+# First number in a price string like '₹1,299' or '$29.99'
+_PRICE_RE = re.compile(r'[\d,]+(?:\.\d+)?')
+
+# Repeat searches within 5 minutes are served from memory (saves latency + quota)
+SEARCH_CACHE_SIZE = 512
+SEARCH_CACHE_TTL = 300
+
 
 class AmazonService:
     """Service for fetching products from Amazon via RapidAPI Search"""
@@ -30,11 +48,35 @@ class AmazonService:
         # Default to India store
         self.default_country = "IN"
         
+        # Shared client (created on first use)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._search_cache = AsyncTTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+        self._request_slots = asyncio.Semaphore(RAPIDAPI_MAX_CONCURRENCY)
+        
         if self.api_key:
             logger.info("✅ Amazon Service configured (RapidAPI Search)")
         else:
             logger.warning("⚠️ Amazon Service: RAPIDAPI_KEY not set")
     
+    def _get_client(self) -> httpx.AsyncClient:
+        """Shared RapidAPI client with the auth headers preset"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.BASE_URL,
+                headers=self.headers,
+                timeout=HTTP_TIMEOUT,
+                limits=HTTP_LIMITS,
+                # Parallel searches (tops + bottoms) share one connection as HTTP/2 streams
+                http2=True
+            )
+        return self._client
+    
+    async def aclose(self):
+        """Close the shared HTTP client (call on shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
     async def search_products(
         self,
         query: str,
@@ -56,11 +98,18 @@ class AmazonService:
             logger.warning("Amazon API key not configured")
             return []
         
+        # Identical concurrent searches share one request; failures (empty) aren't cached
+        return await self._search_cache.get_or_load(
+            (query, sort_by, self.default_country, limit),
+            lambda: self._fetch_products(query, limit, sort_by)
+        )
+    
+    async def _fetch_products(self, query: str, limit: int, sort_by: str) -> List[Dict]:
+        """Call the RapidAPI search endpoint (uncached)"""
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(
-                    f"{self.BASE_URL}/search",
-                    headers=self.headers,
+            async with self._request_slots:
+                response = await self._get_client().get(
+                    "/search",
                     params={
                         "query": query,
                         "page": "1",
@@ -69,28 +118,26 @@ class AmazonService:
                         "product_condition": "NEW"
                     }
                 )
-                
-                if response.status_code != 200:
-                    logger.error(f"Amazon Search API error: {response.status_code} - {response.text[:200]}")
-                    return []
-                
-                data = response.json()
-                
-                # Extract products from response
-                products = data.get("data", {}).get("products", [])
-                
-                if not products:
-                    logger.warning(f"No Amazon products found for: {query}")
-                    return []
-                
-                logger.info(f"Found {len(products)} Amazon products for: {query}")
-                
-                return products[:limit]
-                
+            
+            if response.status_code != 200:
+                logger.error("Amazon Search API error: %s - %s", response.status_code, response.text[:200])
+                return []
+            
+            data = orjson.loads(response.content)
+            
+            # Extract products from response
+            products = data.get("data", {}).get("products", [])
+            
+            if not products:
+                logger.warning("No Amazon products found for: %s", query)
+                return []
+            
+            logger.info("Found %s Amazon products for: %s", len(products), query)
+            
+            return products[:limit]
+            
         except Exception as e:
-            logger.error(f"Amazon Search API request failed: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
+            logger.exception("Amazon Search API request failed: %s", e)
             return []
     
     async def get_tops(self, query: str = "", limit: int = 10, gender: str = "women") -> List[Dict]:
@@ -99,12 +146,10 @@ class AmazonService:
         search_query = await llm_service.generate_search_query_for_category(query, "top", gender)
         
         products = await self.search_products(search_query, limit=limit * 3, sort_by="BEST_SELLERS")
-        transformed = self._transform_products(products, "top")
+        transformed = self._transform_products(products, "top", gender)
         
         # Filter by gender using LLM
-        filtered = await llm_service.classify_product_gender(transformed, gender)
-        
-        return filtered[:limit]
+        return await llm_service.classify_product_gender(transformed, gender, limit=limit)
     
     async def get_bottoms(self, query: str = "", limit: int = 10, gender: str = "women") -> List[Dict]:
         """Get bottom/pants products from Amazon"""
@@ -112,82 +157,74 @@ class AmazonService:
         search_query = await llm_service.generate_search_query_for_category(query, "bottom", gender)
         
         products = await self.search_products(search_query, limit=limit * 3, sort_by="BEST_SELLERS")
-        transformed = self._transform_products(products, "bottom")
+        transformed = self._transform_products(products, "bottom", gender)
         
         # Filter by gender using LLM
-        filtered = await llm_service.classify_product_gender(transformed, gender)
-        
-        return filtered[:limit]
+        return await llm_service.classify_product_gender(transformed, gender, limit=limit)
     
-    def _transform_products(self, products: List[Dict], category: str) -> List[Dict]:
-        """Transform Amazon Best Sellers API response to our product format"""
+    def _transform_products(
+        self,
+        products: List[Dict],
+        category: str,
+        gender: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Transform Amazon Best Sellers API response to our product format
+        
+        Products whose title mentions the other gender are dropped up front,
+        so they're neither transformed nor sent to the LLM classifier.
+        """
         transformed = []
         
         for product in products:
-            try:
-                # Get ASIN (Amazon Standard Identification Number)
-                asin = product.get("asin", "")
-                
-                # Get product title (best sellers use product_title)
-                name = product.get("product_title", "") or product.get("title", "Fashion Item")
-                
-                # Get price - best sellers format
-                price_info = product.get("product_price", "")
-                if isinstance(price_info, dict):
-                    price = self._parse_price(price_info.get("value", ""))
-                else:
-                    price = self._parse_price(price_info)
-                
-                # Get image URL (best sellers use product_photo)
-                image_url = product.get("product_photo", "")
-                if not image_url:
-                    image_url = product.get("product_main_image_url", "")
-                if not image_url:
-                    image_url = product.get("image", "")
-                
-                # Get product URL
-                product_url = product.get("product_url", "")
-                if not product_url and asin:
-                    product_url = f"https://www.amazon.in/dp/{asin}"
-                
-                # Skip if no image
-                if not image_url:
-                    continue
-                
-                # Get rating (best sellers format)
-                rating = product.get("product_star_rating", "")
-                if not rating:
-                    rating = product.get("rating", "")
-                
-                # Get reviews count
-                reviews = product.get("product_num_ratings", 0)
-                if not reviews:
-                    reviews = product.get("reviews_count", 0)
-                
-                # Get rank
-                rank = product.get("rank", 0)
-                
-                transformed.append({
-                    "id": asin,
-                    "name": name[:100],  # Truncate long names
-                    "category": category,
-                    "price": price,
-                    "currency": "INR",
-                    "image_url": image_url,
-                    "buy_url": product_url,
-                    "brand": product.get("product_brand", "Amazon"),
-                    "description": name,
-                    "colors": [],
-                    "sizes": [],
-                    "source": "amazon",
-                    "rating": rating,
-                    "reviews": reviews,
-                    "best_seller_rank": rank
-                })
-                
-            except Exception as e:
-                logger.warning(f"Failed to transform Amazon product: {e}")
+            if not isinstance(product, dict):
                 continue
+            
+            # Get product title (best sellers use product_title)
+            name = product.get("product_title") or product.get("title") or "Fashion Item"
+            if gender and names_other_gender(name, gender):
+                continue
+            
+            # Get image URL (best sellers use product_photo); skip if missing
+            image_url = (
+                product.get("product_photo")
+                or product.get("product_main_image_url")
+                or product.get("image")
+            )
+            if not image_url:
+                continue
+            
+            # Get ASIN (Amazon Standard Identification Number)
+            asin = product.get("asin", "")
+            
+            # Get price - best sellers format
+            price_info = product.get("product_price", "")
+            if isinstance(price_info, dict):
+                price_info = price_info.get("value", "")
+            
+            # Get product URL
+            product_url = product.get("product_url") or (
+                f"https://www.amazon.in/dp/{asin}" if asin else ""
+            )
+            
+            transformed.append({
+                "id": asin,
+                "name": name[:100],  # Truncate long names
+                "category": category,
+                "price": self._parse_price(price_info),
+                "currency": "INR",
+                "image_url": image_url,
+                "buy_url": product_url,
+                "brand": product.get("product_brand", "Amazon"),
+                "description": name,
+                "colors": [],
+                "sizes": [],
+                "source": "amazon",
+                # Rating/reviews/rank (best sellers format first)
+                "rating": product.get("product_star_rating") or product.get("rating", ""),
+                "reviews": product.get("product_num_ratings") or product.get("reviews_count", 0),
+                "best_seller_rank": product.get("rank", 0)
+            })
         
         return transformed
     
@@ -196,14 +233,11 @@ class AmazonService:
         if not price_str:
             return 0.0
         
-        import re
-        # Remove currency symbols and extract numbers
-        numbers = re.findall(r'[\d,]+\.?\d*', str(price_str))
-        if numbers:
-            # Take the first number found
-            price_text = numbers[0].replace(',', '')
+        # Skip currency symbols, take the first number found
+        match = _PRICE_RE.search(str(price_str))
+        if match:
             try:
-                return float(price_text)
+                return float(match.group().replace(',', ''))
             except ValueError:
                 return 0.0
         return 0.0
@@ -227,9 +261,8 @@ class AmazonService:
         Returns:
             Dictionary with 'tops' and 'bottoms' lists
         """
-        logger.info(f"🛒 Searching Amazon for: {gender}'s fashion ({prompt})")
+        logger.info("🛒 Searching Amazon for: %s's fashion (%s)", gender, prompt)
         
-        import asyncio
         tops_task = self.get_tops(prompt, limit=num_tops, gender=gender)
         bottoms_task = self.get_bottoms(prompt, limit=num_bottoms, gender=gender)
         
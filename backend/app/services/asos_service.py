@@ -3,14 +3,28 @@ ASOS API Service - Real-time fashion product browsing
 Uses RapidAPI ASOS endpoint for live product data
 API: https://rapidapi.com/api/asos10
 """
+import asyncio
 import httpx
+import orjson
 import logging
 from typing import List, Dict, Optional
 from app.config import settings
-from app.services.llm_service import llm_service
+from app.services.cache import AsyncTTLCache
+from app.services.llm_service import llm_service, names_other_gender
 
 logger = logging.getLogger(__name__)
 
+# Pooled connections to RapidAPI (keep-alive skips the TLS handshake per search)
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+
+# Max in-flight RapidAPI searches per process (bursts queue instead of hitting 429s)
+RAPIDAPI_MAX_CONCURRENCY = 8
+
+# Repeat searches within 5 minutes are served from memory (saves latency + quota)
+SEARCH_CACHE_SIZE = 512
+SEARCH_CACHE_TTL = 300
+
 
 class ASOSService:
     """Service for fetching real products from ASOS via RapidAPI"""
@@ -36,6 +50,30 @@ class ASOSService:
         
         # USD to INR conversion rate (approximate)
         self.usd_to_inr = 83.0
+        
+        # Shared client (created on first use)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._search_cache = AsyncTTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+        self._request_slots = asyncio.Semaphore(RAPIDAPI_MAX_CONCURRENCY)
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """Shared RapidAPI client with the auth headers preset"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.BASE_URL,
+                headers=self.headers,
+                timeout=HTTP_TIMEOUT,
+                limits=HTTP_LIMITS,
+                # Parallel searches (tops + bottoms) share one connection as HTTP/2 streams
+                http2=True
+            )
+        return self._client
+    
+    async def aclose(self):
+        """Close the shared HTTP client (call on shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
     
     async def search_products(
         self,
@@ -62,49 +100,63 @@ class ASOSService:
             logger.warning("RapidAPI key not configured")
             return []
         
+        # Identical concurrent searches share one request; failures (empty) aren't cached
+        products = await self._search_cache.get_or_load(
+            (query, category, limit, sort, gender),
+            lambda: self._fetch_products(query, category, limit, sort, gender)
+        )
+        # Callers tag products in place (e.g. "source"), so hand out copies
+        return [dict(p) for p in products]
+    
+    async def _fetch_products(
+        self,
+        query: str,
+        category: str,
+        limit: int,
+        sort: str,
+        gender: str
+    ) -> List[Dict]:
+        """Search, transform and gender-filter ASOS products (uncached)"""
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                params = {
-                    **self.default_params,
-                    "searchTerm": query,
-                    "limit": str(limit),
-                    "offset": "0",
-                    "sort": sort
-                }
-                
-                response = await client.get(
-                    f"{self.BASE_URL}/getProductListBySearchTerm",
-                    headers=self.headers,
+            params = {
+                **self.default_params,
+                "searchTerm": query,
+                "limit": str(limit),
+                "offset": "0",
+                "sort": sort
+            }
+            
+            async with self._request_slots:
+                response = await self._get_client().get(
+                    "/getProductListBySearchTerm",
                     params=params
                 )
-                
-                if response.status_code != 200:
-                    logger.error(f"ASOS API error: {response.status_code} - {response.text[:200]}")
-                    return []
-                
-                data = response.json()
-                
-                # Extract products from response
-                products = []
-                if isinstance(data, dict):
-                    products = data.get("data", {}).get("products", [])
-                    if not products:
-                        products = data.get("products", [])
-                
-                logger.info(f"Found {len(products)} ASOS products for: {query}")
-                
-                # Transform products
-                transformed = self._transform_products(products, category)
-                
-                # Filter by gender using LLM
-                filtered = await llm_service.classify_product_gender(transformed, gender)
-                logger.info(f"After LLM gender filter ({gender}): {len(filtered)} products")
-                return filtered
-                
+            
+            if response.status_code != 200:
+                logger.error("ASOS API error: %s - %s", response.status_code, response.text[:200])
+                return []
+            
+            data = orjson.loads(response.content)
+            
+            # Extract products from response
+            products = []
+            if isinstance(data, dict):
+                products = data.get("data", {}).get("products", [])
+                if not products:
+                    products = data.get("products", [])
+            
+            logger.info("Found %s ASOS products for: %s", len(products), query)
+            
+            # Transform products
+            transformed = self._transform_products(products, category, gender)
+            
+            # Filter by gender using LLM
+            filtered = await llm_service.classify_product_gender(transformed, gender)
+            logger.info("After LLM gender filter (%s): %s products", gender, len(filtered))
+            return filtered
+            
         except Exception as e:
-            logger.error(f"ASOS API request failed: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
+            logger.exception("ASOS API request failed: %s", e)
             return []
     
     async def get_tops(self, query: str = "", limit: int = 10, gender: str = "women") -> List[Dict]:
@@ -125,8 +177,18 @@ class ASOSService:
         return await self.search_products(search_query, category="dress", limit=limit)
     
     
-    def _transform_products(self, products: List[Dict], category: str) -> List[Dict]:
-        """Transform ASOS API response to our product format"""
+    def _transform_products(
+        self,
+        products: List[Dict],
+        category: str,
+        gender: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Transform ASOS API response to our product format
+        
+        Products whose name mentions the other gender are dropped up front,
+        so they're neither transformed nor sent to the LLM classifier.
+        """
         transformed = []
         
         for product in products:
@@ -136,6 +198,8 @@ class ASOSService:
                 
                 # Get name
                 name = product.get("name", "Fashion Item")
+                if gender and names_other_gender(name, gender):
+                    continue
                 
                 # Get price
                 price_info = product.get("price", {})
@@ -174,7 +238,7 @@ class ASOSService:
                 color = product.get("colour", "")
                 
                 if not image_url:
-                    logger.warning(f"Skipping ASOS product {product_id} - no image")
+                    logger.warning("Skipping ASOS product %s - no image", product_id)
                     continue
                 
                 # Convert USD to INR
@@ -196,7 +260,7 @@ class ASOSService:
                 })
                 
             except Exception as e:
-                logger.warning(f"Failed to transform ASOS product: {e}")
+                logger.warning("Failed to transform ASOS product: %s", e)
                 continue
         
         return transformed
@@ -220,9 +284,8 @@ class ASOSService:
         Returns:
             Dictionary with 'tops' and 'bottoms' lists
         """
-        logger.info(f"Browsing ASOS for: {prompt} (Gender: {gender})")
+        logger.info("Browsing ASOS for: %s (Gender: %s)", prompt, gender)
         
-        import asyncio
         tops_task = self.get_tops(prompt, limit=num_tops, gender=gender)
         bottoms_task = self.get_bottoms(prompt, limit=num_bottoms, gender=gender)
         
@@ -0,0 +1,92 @@
+"""
+In-process caches
+Small TTL + LRU cache used to skip repeated external calls (LLM, APIs)
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after a fixed TTL"""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None if missing/expired"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Store a value, evicting the least recently used entry when full"""
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """Snapshot of the live (unexpired) entries, least recently used first"""
+        now = time.monotonic()
+        return [(key, value) for key, (expires_at, value) in self._data.items() if expires_at >= now]
+
+    def pop(self, key: Hashable) -> None:
+        """Remove an entry if present"""
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class AsyncTTLCache(TTLCache):
+    """TTLCache that loads misses once per key, even for concurrent callers"""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 3600.0):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        cache_if: Callable[[Any], bool] = bool
+    ) -> Any:
+        """
+        Return the cached value, or await loader() and cache its result.
+
+        Concurrent misses for the same key share one loader call (single
+        flight). Results failing cache_if (by default: falsy ones such as
+        None or [] from a failed request) are returned but not cached.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(loader())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._store(key, done, cache_if))
+
+        # Shielded: one caller being cancelled must not cancel the shared load
+        return await asyncio.shield(task)
+
+    def _store(self, key: Hashable, task: asyncio.Future, cache_if: Callable[[Any], bool]) -> None:
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None and cache_if(task.result()):
+            self.set(key, task.result())
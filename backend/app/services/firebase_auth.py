@@ -3,13 +3,20 @@ Firebase Authentication Service
 Verifies Firebase ID tokens for authenticated requests
 """
 
+import asyncio
+import hashlib
 import logging
-from typing import Optional
+import time
+from typing import Dict, Optional
 import httpx
-from jose import jwt, JWTError
-from datetime import datetime
+import orjson
+import jwt
+from cryptography import x509
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
 import json
 
+from app.services.cache import TTLCache
+
 logger = logging.getLogger(__name__)
 
 # Firebase public keys URL
@@ -19,50 +26,126 @@ FIREBASE_PROJECT_ID = "outfit-planner-ca620"
 # Cache for Firebase public keys
 _cached_keys = None
 _keys_expiry = None
+# Same keys parsed into verifier objects (kid -> key), rebuilt once per rotation
+_parsed_keys: Dict[str, RSAPublicKey] = {}
+# One refresh at a time; other verifications wait for it instead of refetching
+_keys_lock = asyncio.Lock()
+
+# An unknown kid (Google rotated its keys) forces a refresh at most this often (seconds)
+KID_MISS_REFRESH_INTERVAL = 60
+_last_kid_miss_refresh: Optional[float] = None
+
+# Shared client for key refreshes (created on first use)
+_http_client: Optional[httpx.AsyncClient] = None
+
+# Recently verified tokens (sha256 of token -> payload), kept at most 5 minutes
+VERIFIED_TOKEN_CACHE_SIZE = 10_000
+VERIFIED_TOKEN_TTL = 300
+_verified_tokens = TTLCache(maxsize=VERIFIED_TOKEN_CACHE_SIZE, ttl=VERIFIED_TOKEN_TTL)
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    """Shared client, so key refreshes reuse the pooled connection"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient()
+    return _http_client
+
+
+async def close_http_client():
+    """Close the shared HTTP client (call on shutdown)"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def _keys_fresh(now: float) -> bool:
+    return bool(_cached_keys and _keys_expiry and now < _keys_expiry)
 
 
 async def get_firebase_public_keys():
     """Fetch Firebase public keys (cached)"""
-    global _cached_keys, _keys_expiry
-    
-    now = datetime.utcnow()
-    
     # Return cached keys if still valid
-    if _cached_keys and _keys_expiry and now < _keys_expiry:
+    if _keys_fresh(time.time()):
         return _cached_keys
     
+    async with _keys_lock:
+        # Another request may have refreshed them while we waited
+        if _keys_fresh(time.time()):
+            return _cached_keys
+        return await _refresh_firebase_public_keys()
+
+
+async def _refresh_firebase_public_keys():
+    """Download the current keys and parse each certificate once"""
+    global _cached_keys, _keys_expiry, _parsed_keys
+    
+    now = time.time()
+    
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(FIREBASE_KEYS_URL)
+        response = await _get_http_client().get(FIREBASE_KEYS_URL)
+        
+        if response.status_code == 200:
+            _cached_keys = orjson.loads(response.content)
+            _parsed_keys = {
+                kid: x509.load_pem_x509_certificate(pem.encode()).public_key()
+                for kid, pem in _cached_keys.items()
+            }
+            
+            # Parse cache-control header for expiry
+            cache_control = response.headers.get("cache-control", "")
+            max_age = 3600  # Default 1 hour
+            for part in cache_control.split(","):
+                if "max-age=" in part:
+                    try:
+                        max_age = int(part.split("=")[1].strip())
+                    except:
+                        pass
             
-            if response.status_code == 200:
-                _cached_keys = response.json()
-                
-                # Parse cache-control header for expiry
-                cache_control = response.headers.get("cache-control", "")
-                max_age = 3600  # Default 1 hour
-                for part in cache_control.split(","):
-                    if "max-age=" in part:
-                        try:
-                            max_age = int(part.split("=")[1].strip())
-                        except:
-                            pass
-                
-                from datetime import timedelta
-                _keys_expiry = now + timedelta(seconds=max_age)
-                
-                return _cached_keys
+            _keys_expiry = now + max_age
+            
+            return _cached_keys
     except Exception as e:
-        logger.error(f"Failed to fetch Firebase keys: {e}")
+        logger.error("Failed to fetch Firebase keys: %s", e)
     
     return _cached_keys  # Return cached even if expired, as fallback
 
 
+async def _refresh_for_unknown_kid(kid: str) -> Optional[RSAPublicKey]:
+    """
+    Refetch the keys once for a kid that isn't cached (signed with a newly
+    rotated key), rate-limited so bogus kids can't hammer Google
+    """
+    global _last_kid_miss_refresh
+    
+    async with _keys_lock:
+        # Another request may have picked up the new keys while we waited
+        public_key = _parsed_keys.get(kid)
+        if public_key is not None:
+            return public_key
+        
+        now = time.time()
+        if _last_kid_miss_refresh and now - _last_kid_miss_refresh < KID_MISS_REFRESH_INTERVAL:
+            return None
+        _last_kid_miss_refresh = now
+        
+        logger.info("Unknown key %s, refreshing Firebase keys", kid)
+        await _refresh_firebase_public_keys()
+        return _parsed_keys.get(kid)
+
+
 async def verify_firebase_token(token: str) -> Optional[dict]:
     """
     Verify a Firebase ID token
     Returns the decoded token payload if valid, None otherwise
     """
+    # Skip the signature check for tokens verified recently
+    token_hash = hashlib.sha256(token.encode()).digest()
+    cached_payload = _verified_tokens.get(token_hash)
+    if cached_payload is not None:
+        return cached_payload
+    
     try:
         # Get the key ID from the token header
         unverified_header = jwt.get_unverified_header(token)
@@ -73,13 +156,15 @@ async def verify_firebase_token(token: str) -> Optional[dict]:
             return None
         
         # Get public keys
-        keys = await get_firebase_public_keys()
-        if not keys or kid not in keys:
-            logger.warning(f"Key {kid} not found in Firebase keys")
-            return None
+        await get_firebase_public_keys()
         
-        # Get the public key
-        public_key = keys[kid]
+        # Already-parsed key, so the PEM certificate isn't re-read per token
+        public_key = _parsed_keys.get(kid)
+        if public_key is None:
+            public_key = await _refresh_for_unknown_kid(kid)
+        if public_key is None:
+            logger.warning("Key %s not found in Firebase keys", kid)
+            return None
         
         # Decode and verify the token
         payload = jwt.decode(
@@ -87,22 +172,27 @@ async def verify_firebase_token(token: str) -> Optional[dict]:
             public_key,
             algorithms=["RS256"],
             audience=FIREBASE_PROJECT_ID,
-            issuer=f"https://securetoken.google.com/{FIREBASE_PROJECT_ID}"
+            issuer=f"https://securetoken.google.com/{FIREBASE_PROJECT_ID}",
+            options={"require": ["exp", "iat", "aud", "iss"]}
         )
         
         # Verify expiration
         exp = payload.get("exp", 0)
-        if datetime.utcnow().timestamp() > exp:
+        remaining = exp - time.time()
+        if remaining < 0:
             logger.warning("Token expired")
             return None
         
+        # Never cache a token past its own expiry
+        _verified_tokens.set(token_hash, payload, ttl=min(remaining, VERIFIED_TOKEN_TTL))
+        
         return payload
         
-    except JWTError as e:
-        logger.warning(f"JWT verification failed: {e}")
+    except jwt.PyJWTError as e:
+        logger.warning("JWT verification failed: %s", e)
         return None
     except Exception as e:
-        logger.error(f"Token verification error: {e}")
+        logger.error("Token verification error: %s", e)
         return None
 
 
@@ -8,23 +8,47 @@ import io
 import os
 import logging
 import httpx
-from PIL import Image
-from rembg import remove, new_session
-from typing import Optional, Tuple
+from PIL import Image, ImageChops
+from typing import Dict, Optional, Tuple
+from functools import lru_cache
 import base64
 import asyncio
-import uuid
+import secrets
 
 import cloudinary
 import cloudinary.uploader
 
 from app.config import settings
+from app.services.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
 # Replicate model for clothing segmentation
 CLOTHING_SEG_MODEL = "naklecha/clothing-segmentation:501aa8488496fffc6bbee9544729dc28654649f2e3c80de0bf08fb9fe71898f8"
 
+# Shared HTTP client settings (product image and Cloudinary downloads)
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=30.0)
+DIRECT_DOWNLOAD_TIMEOUT = 20.0
+# Retries on connection failures (not on HTTP error statuses)
+HTTP_CONNECT_RETRIES = 2
+# Product images larger than this (by Content-Length) aren't downloaded
+MAX_IMAGE_BYTES = 25 * 1024 * 1024
+
+# ETag/Last-Modified of directly downloaded images, for conditional re-fetches
+SOURCE_VALIDATOR_CACHE_SIZE = 1024
+SOURCE_VALIDATOR_TTL = 24 * 3600
+
+# Second-attempt headers: plain image request that looks like it came from search
+FALLBACK_DOWNLOAD_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "image/*",
+    "Referer": "https://www.google.com/",
+}
+
+# Opaque uploads are sent as JPEG at this quality (transparent ones as lossless WebP)
+UPLOAD_JPEG_QUALITY = 90
+
 # Configure Cloudinary
 cloudinary.config(
     cloud_name=settings.CLOUDINARY_CLOUD_NAME,
@@ -33,18 +57,46 @@ cloudinary.config(
 )
 
 
+def encode_for_upload(image: Image.Image, quality: int = UPLOAD_JPEG_QUALITY) -> io.BytesIO:
+    """
+    Encode an image for upload: lossless WebP if it has any transparency,
+    otherwise progressive JPEG (several times smaller than PNG)
+    """
+    buffer = io.BytesIO()
+    if image.mode in ("RGBA", "LA") and image.getchannel("A").getextrema()[0] < 255:
+        image.save(buffer, format="WEBP", lossless=True, method=4)
+    else:
+        image.convert("RGB").save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+    buffer.seek(0)
+    return buffer
+
+
+def decode_image(data: bytes, mode: str = "RGBA") -> Image.Image:
+    """Decode and convert image bytes (run via asyncio.to_thread for large images)"""
+    # BytesIO over bytes shares the buffer, so the body isn't copied again
+    return Image.open(io.BytesIO(data)).convert(mode)
+
+
+@lru_cache(maxsize=1)
+def get_rembg_session():
+    """Load the rembg fallback session once, on first use"""
+    # Imported here: rembg pulls in onnxruntime, which is slow to import
+    from rembg import new_session
+    
+    try:
+        session = new_session("u2net_cloth_seg")
+        logger.info("rembg fallback ready with u2net_cloth_seg")
+    except Exception as e:
+        logger.warning("Could not load cloth_seg model, falling back to default: %s", e)
+        session = new_session("u2net")
+    return session
+
+
 class GarmentExtractor:
     """Service to extract garments from product images using mask-based extraction"""
     
     def __init__(self):
-        # Initialize rembg session as fallback
         logger.info("Initializing garment extractor with mask-based extraction...")
-        try:
-            self.rembg_session = new_session("u2net_cloth_seg")
-            logger.info("rembg fallback ready with u2net_cloth_seg")
-        except Exception as e:
-            logger.warning(f"Could not load cloth_seg model, falling back to default: {e}")
-            self.rembg_session = new_session("u2net")
         
         # Check Replicate token
         self.replicate_token = getattr(settings, 'REPLICATE_API_TOKEN', '')
@@ -53,59 +105,170 @@ class GarmentExtractor:
             logger.info("Replicate clothing segmentation enabled (mask approach)")
         else:
             logger.warning("No Replicate token - will use rembg only")
+        
+        # Pooled client reused across downloads (created on first use)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._source_validators = TTLCache(maxsize=SOURCE_VALIDATOR_CACHE_SIZE, ttl=SOURCE_VALIDATOR_TTL)
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """Shared client, so repeat downloads from the same CDN skip the TCP/TLS handshake"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=HTTP_TIMEOUT,
+                follow_redirects=True,
+                # Pool settings live on the transport when one is passed
+                transport=httpx.AsyncHTTPTransport(
+                    limits=HTTP_LIMITS,
+                    http2=True,
+                    retries=HTTP_CONNECT_RETRIES
+                )
+            )
+        return self._client
+    
+    async def aclose(self):
+        """Close the shared HTTP client (call on shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def _fetch_image_bytes(
+        self,
+        url: str,
+        headers: dict,
+        timeout: float
+    ) -> Tuple[int, Optional[bytes]]:
+        """
+        GET an image, returning (status_code, body)
+        
+        The body is only read for 200 responses that look like an image, so
+        blocked requests (HTML error/captcha pages) and oversized files are
+        abandoned after the headers instead of being downloaded.
+        """
+        async with self._get_client().stream("GET", url, headers=headers, timeout=timeout) as response:
+            if response.status_code != 200:
+                return response.status_code, None
+            
+            content_type = response.headers.get("content-type", "")
+            if content_type and not content_type.startswith("image/") and "octet-stream" not in content_type:
+                return response.status_code, None
+            
+            content_length = response.headers.get("content-length", "")
+            if content_length.isdigit() and int(content_length) > MAX_IMAGE_BYTES:
+                logger.warning("Image too large (%s bytes), skipping download", content_length)
+                return response.status_code, None
+            
+            content = await response.aread()
+            
+            validators = {
+                name: response.headers[name]
+                for name in ("etag", "last-modified")
+                if name in response.headers
+            }
+            if validators:
+                # Revalidate with the headers this host actually served
+                self._source_validators.set(url, {"validators": validators, "headers": dict(headers)})
+            
+            return response.status_code, content
+    
+    def source_validators(self, url: str) -> Optional[Dict[str, dict]]:
+        """
+        ETag/Last-Modified from the last successful download of `url`, with
+        the request headers that download used (None if unknown)
+        """
+        return self._source_validators.get(url)
+    
+    async def is_source_unchanged(self, url: str, validators: Dict[str, dict]) -> bool:
+        """
+        Conditional GET against the source image
+        
+        Sent with the same headers as the download that produced the
+        validators, so hosts that only serve the fallback headers aren't
+        re-blocked. Returns True on 304 Not Modified. The body of a changed
+        image is never read, so revalidation costs one round trip either way.
+        """
+        headers = dict(validators["headers"])
+        # The original download may have asked caches not to answer it
+        headers.pop("Cache-Control", None)
+        headers.pop("Pragma", None)
+        if "etag" in validators["validators"]:
+            headers["If-None-Match"] = validators["validators"]["etag"]
+        if "last-modified" in validators["validators"]:
+            headers["If-Modified-Since"] = validators["validators"]["last-modified"]
+        
+        try:
+            async with self._get_client().stream(
+                "GET", url, headers=headers, timeout=DIRECT_DOWNLOAD_TIMEOUT
+            ) as response:
+                return response.status_code == 304
+        except Exception as e:
+            logger.warning("Source revalidation failed: %s", e)
+            return False
+    
+    def _direct_headers(self, url: str) -> Dict[str, str]:
+        """Browser-like headers for a direct image request (with the store's Referer if it needs one)"""
+        headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+            "Accept": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8",
+            "Accept-Language": "en-US,en;q=0.9",
+            # Images are already compressed; gzip/br would only cost CPU
+            "Accept-Encoding": "identity",
+            "Connection": "keep-alive",
+        }
+        
+        # Add referer based on URL
+        if "asos" in url.lower():
+            headers["Referer"] = "https://www.asos.com/"
+            headers["Origin"] = "https://www.asos.com"
+        
+        return headers
     
     async def download_image(self, url: str) -> Optional[Image.Image]:
         """Download image from URL with proper headers, with multiple fallback strategies"""
+        image, _ = await self._download_image(url)
+        return image
+    
+    async def _download_image(self, url: str) -> Tuple[Optional[Image.Image], bool]:
+        """
+        Download an image, trying each strategy in turn
         
+        Returns:
+            Tuple of (image, publicly_fetchable). publicly_fetchable is True when
+            a plain request without a site Referer worked, so other services
+            (Replicate) can fetch the URL themselves.
+        """
         # Strategy 1: Direct download with full browser-like headers
         try:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                "Accept": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8",
-                "Accept-Language": "en-US,en;q=0.9",
-                "Accept-Encoding": "gzip, deflate, br",
-                "Connection": "keep-alive",
-                "Cache-Control": "no-cache",
-                "Pragma": "no-cache",
-            }
+            headers = self._direct_headers(url)
+            headers["Cache-Control"] = "no-cache"
+            headers["Pragma"] = "no-cache"
             
-            # Add referer based on URL
-            if "asos" in url.lower():
-                headers["Referer"] = "https://www.asos.com/"
-                headers["Origin"] = "https://www.asos.com"
-            
-            async with httpx.AsyncClient(timeout=20.0, follow_redirects=True) as client:
-                response = await client.get(url, headers=headers)
-                if response.status_code == 200 and len(response.content) > 1000:
-                    logger.info(f"Direct download successful ({len(response.content)} bytes)")
-                    return Image.open(io.BytesIO(response.content)).convert("RGBA")
-                elif response.status_code in [403, 401]:
-                    logger.info(f"Direct download blocked ({response.status_code})")
-                else:
-                    logger.warning(f"Download returned status {response.status_code}")
+            status, content = await self._fetch_image_bytes(url, headers, DIRECT_DOWNLOAD_TIMEOUT)
+            if content is not None and len(content) > 1000:
+                logger.info("Direct download successful (%s bytes)", len(content))
+                return await asyncio.to_thread(decode_image, content), "Referer" not in headers
+            elif status in [403, 401]:
+                logger.info("Direct download blocked (%s)", status)
+            elif status == 200:
+                logger.warning("Download returned a non-image response")
+            else:
+                logger.warning("Download returned status %s", status)
         except httpx.TimeoutException:
             logger.warning("Direct download timed out")
         except Exception as e:
-            logger.warning(f"Direct download failed: {e}")
+            logger.warning("Direct download failed: %s", e)
         
-        # Strategy 2: Try with requests library (different HTTP client)
+        # Strategy 2: Retry with plain search-referred headers
         try:
-            import requests
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                "Accept": "image/*",
-                "Referer": "https://www.google.com/",
-            }
-            response = requests.get(url, headers=headers, timeout=15, allow_redirects=True)
-            if response.status_code == 200 and len(response.content) > 1000:
-                logger.info(f"Requests library download successful ({len(response.content)} bytes)")
-                return Image.open(io.BytesIO(response.content)).convert("RGBA")
+            _, content = await self._fetch_image_bytes(url, FALLBACK_DOWNLOAD_HEADERS, 15.0)
+            if content is not None and len(content) > 1000:
+                logger.info("Fallback-header download successful (%s bytes)", len(content))
+                return await asyncio.to_thread(decode_image, content), False
         except Exception as e:
-            logger.warning(f"Requests library download failed: {e}")
+            logger.warning("Fallback-header download failed: %s", e)
         
         # Strategy 3: Use Cloudinary's fetch feature (proxies the image)
         logger.info("Trying Cloudinary fetch...")
-        return await self._download_via_cloudinary(url)
+        return await self._download_via_cloudinary(url), False
     
     async def _download_via_cloudinary(self, url: str) -> Optional[Image.Image]:
         """Use Cloudinary's fetch feature to download blocked images"""
@@ -115,19 +278,18 @@ class GarmentExtractor:
             encoded_url = urllib.parse.quote(url, safe='')
             cloudinary_url = f"https://res.cloudinary.com/{settings.CLOUDINARY_CLOUD_NAME}/image/fetch/{encoded_url}"
             
-            logger.info(f"Fetching via Cloudinary: {cloudinary_url[:80]}...")
+            logger.info("Fetching via Cloudinary: %s...", cloudinary_url[:80])
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(cloudinary_url, follow_redirects=True)
-                if response.status_code == 200:
-                    logger.info("Cloudinary fetch successful!")
-                    return Image.open(io.BytesIO(response.content)).convert("RGBA")
-                else:
-                    logger.error(f"Cloudinary fetch failed: {response.status_code}")
-                    # Try uploading the URL directly to Cloudinary as a remote fetch
-                    return await self._upload_and_download(url)
+            response = await self._get_client().get(cloudinary_url)
+            if response.status_code == 200:
+                logger.info("Cloudinary fetch successful!")
+                return await asyncio.to_thread(decode_image, response.content)
+            else:
+                logger.error("Cloudinary fetch failed: %s", response.status_code)
+                # Try uploading the URL directly to Cloudinary as a remote fetch
+                return await self._upload_and_download(url)
         except Exception as e:
-            logger.error(f"Cloudinary fetch error: {e}")
+            logger.error("Cloudinary fetch error: %s", e)
             return await self._upload_and_download(url)
     
     async def _upload_and_download(self, url: str) -> Optional[Image.Image]:
@@ -143,33 +305,32 @@ class GarmentExtractor:
             )
             if result and result.get('secure_url'):
                 # Download from our Cloudinary
-                async with httpx.AsyncClient(timeout=30.0) as client:
-                    response = await client.get(result['secure_url'])
-                    if response.status_code == 200:
-                        logger.info("Cloudinary upload+download successful!")
-                        return Image.open(io.BytesIO(response.content)).convert("RGBA")
+                response = await self._get_client().get(result['secure_url'])
+                if response.status_code == 200:
+                    logger.info("Cloudinary upload+download successful!")
+                    return await asyncio.to_thread(decode_image, response.content)
             return None
         except Exception as e:
-            logger.error(f"Cloudinary upload+download failed: {e}")
+            logger.error("Cloudinary upload+download failed: %s", e)
             return None
     
+    def _encode_and_upload(self, image: Image.Image, public_id: str) -> dict:
+        """Encode and upload an image (blocking; run via asyncio.to_thread)"""
+        return cloudinary.uploader.upload(
+            encode_for_upload(image),
+            public_id=public_id,
+            resource_type="image"
+        )
+    
     async def upload_to_cloudinary(self, image: Image.Image, prefix: str = "garment") -> Optional[str]:
         """Upload PIL Image to Cloudinary and return URL"""
         try:
-            buffer = io.BytesIO()
-            image.save(buffer, format="PNG")
-            buffer.seek(0)
-            
-            public_id = f"garments/{prefix}_{uuid.uuid4().hex[:8]}"
-            result = await asyncio.to_thread(
-                cloudinary.uploader.upload,
-                buffer,
-                public_id=public_id,
-                resource_type="image"
-            )
+            public_id = f"garments/{prefix}_{secrets.token_hex(4)}"
+            # Encoding is CPU-bound too, so it runs in the same worker thread
+            result = await asyncio.to_thread(self._encode_and_upload, image, public_id)
             return result.get('secure_url')
         except Exception as e:
-            logger.error(f"Cloudinary upload failed: {e}")
+            logger.error("Cloudinary upload failed: %s", e)
             return None
     
     def _run_replicate_segmentation_with_mask(
@@ -205,7 +366,7 @@ class GarmentExtractor:
             return None, None
             
         except Exception as e:
-            logger.error(f"Replicate segmentation error: {e}")
+            logger.error("Replicate segmentation error: %s", e)
             return None, None
     
     async def extract_garment_with_mask(
@@ -234,7 +395,7 @@ class GarmentExtractor:
             return None
         
         try:
-            logger.info(f"Extracting {clothing_type} using MASK approach...")
+            logger.info("Extracting %s using MASK approach...", clothing_type)
             
             # Run Replicate to get mask
             loop = asyncio.get_event_loop()
@@ -250,34 +411,35 @@ class GarmentExtractor:
                 return None
             
             # Load mask
-            mask = Image.open(io.BytesIO(mask_bytes)).convert('L')
+            mask = await asyncio.to_thread(decode_image, mask_bytes, 'L')
             
-            # Resize mask to match original if needed
+            # Resize mask to match original if needed (bilinear: a smooth mask
+            # needs no Lanczos sharpening, which only adds ringing at its edges)
             if mask.size != original_image.size:
-                mask = mask.resize(original_image.size, Image.Resampling.LANCZOS)
+                mask = mask.resize(original_image.size, Image.Resampling.BILINEAR)
             
             # Apply mask to original image - extract only clothing pixels
-            original_rgba = original_image.convert('RGBA')
-            result = Image.new('RGBA', original_image.size, (0, 0, 0, 0))
-            result.paste(original_rgba, mask=mask)
+            # (one C pass scaling the alpha channel; colors stay un-premultiplied)
+            result = original_image.convert('RGBA')
+            result.putalpha(ImageChops.multiply(result.getchannel('A'), mask))
             
-            logger.info(f"Mask extraction successful! Size: {result.size}")
+            logger.info("Mask extraction successful! Size: %s", result.size)
             return result
             
         except Exception as e:
-            logger.error(f"Mask extraction failed: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
+            logger.exception("Mask extraction failed: %s", e)
             return None
     
-    def extract_garment_rembg(self, image: Image.Image) -> Image.Image:
-        """Extract garment using rembg (fallback method)"""
+    def extract_garment_rembg(self, image: Image.Image) -> Optional[Image.Image]:
+        """Extract garment using rembg (fallback method); None if it fails"""
         try:
-            result = remove(image, session=self.rembg_session)
+            from rembg import remove
+            
+            result = remove(image, session=get_rembg_session())
             return result
         except Exception as e:
-            logger.error(f"Error extracting garment with rembg: {e}")
-            return image
+            logger.error("Error extracting garment with rembg: %s", e)
+            return None
     
     def add_white_background(self, image: Image.Image) -> Image.Image:
         """Add white background to transparent image"""
@@ -291,12 +453,60 @@ class GarmentExtractor:
             return background
         return image.convert("RGB")
     
+    async def _extract_with_replicate(
+        self,
+        original_image: Image.Image,
+        clothing_type: str,
+        source_url: Optional[str] = None
+    ) -> Optional[Image.Image]:
+        """
+        Run Replicate on the original image and apply the mask
+        
+        Replicate reads `source_url` directly when given (publicly fetchable);
+        otherwise, or if that fails, the original is uploaded to Cloudinary first.
+        """
+        if source_url:
+            extracted = await self.extract_garment_with_mask(source_url, original_image, clothing_type)
+            if extracted:
+                return extracted
+            logger.info("Replicate couldn't use the source URL, uploading the original...")
+        
+        cloudinary_url = await self.upload_to_cloudinary(original_image, f"original_{clothing_type}")
+        if not cloudinary_url:
+            return None
+        return await self.extract_garment_with_mask(cloudinary_url, original_image, clothing_type)
+    
+    async def _race_extractions(
+        self,
+        original_image: Image.Image,
+        clothing_type: str,
+        source_url: Optional[str] = None
+    ) -> Optional[Image.Image]:
+        """Run Replicate and rembg at the same time and return the first usable result"""
+        pending = {
+            asyncio.create_task(self._extract_with_replicate(original_image, clothing_type, source_url)),
+            # onnxruntime releases the GIL, so run inference off the event loop
+            asyncio.create_task(asyncio.to_thread(self.extract_garment_rembg, original_image)),
+        }
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result():
+                        return task.result()
+            return None
+        finally:
+            # A running rembg thread can't be interrupted; its result is just dropped
+            for task in pending:
+                task.cancel()
+    
     async def extract_from_url(
         self, 
         url: str, 
         clothing_type: str = "topwear",
         add_white_bg: bool = True,
-        use_replicate: bool = True
+        use_replicate: bool = True,
+        prefer_quality: bool = True
     ) -> Optional[Image.Image]:
         """
         Download image and extract garment using mask approach
@@ -306,35 +516,39 @@ class GarmentExtractor:
             clothing_type: "topwear" or "bottomwear"
             add_white_bg: Whether to add white background
             use_replicate: Whether to try Replicate first
+            prefer_quality: Wait for Replicate and only fall back to rembg if it
+                fails. If False, run both at once and take whichever finishes first.
             
         Returns:
             PIL Image with extracted garment
         """
-        logger.info(f"Extracting {clothing_type} from: {url[:60]}...")
+        logger.info("Extracting %s from: %s...", clothing_type, url[:60])
         
         # Download original image first
-        original_image = await self.download_image(url)
+        original_image, url_fetchable = await self._download_image(url)
         if not original_image:
             logger.error("Failed to download original image")
             return None
         
+        # Let Replicate fetch the source itself when it's public (skips an upload)
+        source_url = url if url_fetchable else None
+        
         extracted = None
+        use_replicate = use_replicate and bool(self.replicate_token)
         
-        # Try Replicate MASK approach first (best quality)
-        if use_replicate and self.replicate_token:
-            # Upload to Cloudinary so Replicate can access it
-            cloudinary_url = await self.upload_to_cloudinary(original_image, f"original_{clothing_type}")
-            if cloudinary_url:
-                extracted = await self.extract_garment_with_mask(
-                    cloudinary_url, 
-                    original_image, 
-                    clothing_type
-                )
+        if use_replicate and not prefer_quality:
+            # Speculative: the faster of Replicate and rembg wins (rembg has
+            # already run, so there's no fallback left if both failed)
+            extracted = await self._race_extractions(original_image, clothing_type, source_url)
+        elif use_replicate:
+            # Try Replicate MASK approach first (best quality)
+            extracted = await self._extract_with_replicate(original_image, clothing_type, source_url)
         
         # Fallback to rembg if Replicate failed
-        if not extracted:
+        if not extracted and (prefer_quality or not use_replicate):
             logger.info("Using rembg fallback...")
-            extracted = self.extract_garment_rembg(original_image)
+            # onnxruntime releases the GIL, so run inference off the event loop
+            extracted = await asyncio.to_thread(self.extract_garment_rembg, original_image)
         
         if not extracted:
             logger.error("All extraction methods failed")
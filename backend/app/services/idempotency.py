@@ -0,0 +1,146 @@
+"""
+Idempotency Service
+Dedupes retried POSTs by replaying the first response for the same
+Idempotency-Key (and body), so retries don't consume quota twice
+"""
+import functools
+import hashlib
+import logging
+from typing import Callable
+
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+
+from app.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_CACHE_SIZE = 2048
+
+# Without an explicit key, identical bodies are only deduped briefly (double submits)
+IMPLICIT_KEY_TTL = 30
+
+# Marker stored while the first request is still running
+_IN_PROGRESS = object()
+
+# Headers set per send by middleware (GZip, CORS); never replayed from the cache
+_PER_SEND_HEADERS = frozenset({b"content-encoding", b"content-length", b"vary"})
+_CORS_HEADER_PREFIX = b"access-control-"
+
+
+class _CachedResponse:
+    """
+    Immutable snapshot of a response, rebuilt fresh for each replay
+    
+    Middleware edits a Response's headers in place as it is sent, so the
+    sent object itself can't be replayed (a gzipped Content-Encoding and
+    Content-Length would go out with the plain body).
+    """
+    __slots__ = ("body", "status_code", "media_type", "headers")
+    
+    def __init__(self, response: Response):
+        self.body = bytes(response.body)
+        self.status_code = response.status_code
+        self.media_type = response.media_type
+        self.headers = tuple(
+            (name, value)
+            for name, value in response.raw_headers
+            if name not in _PER_SEND_HEADERS and not name.startswith(_CORS_HEADER_PREFIX)
+        )
+    
+    def build(self) -> Response:
+        response = Response(content=self.body, status_code=self.status_code, media_type=self.media_type)
+        # Content-Type/Length were just set from the body; keep the rest
+        response.raw_headers = [
+            *response.raw_headers,
+            *(header for header in self.headers if header[0] != b"content-type"),
+        ]
+        return response
+
+_responses = TTLCache(maxsize=IDEMPOTENCY_CACHE_SIZE, ttl=IMPLICIT_KEY_TTL)
+
+
+async def _body_digest(request: Request) -> str:
+    """SHA-256 of the request body (of the parsed fields for multipart forms)"""
+    digest = hashlib.sha256()
+    
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        # Form parsing already consumed the stream; the parsed form is cached
+        form = await request.form()
+        for name, value in form.multi_items():
+            digest.update(name.encode())
+            if isinstance(value, str):
+                digest.update(value.encode())
+            else:
+                await value.seek(0)
+                digest.update(await value.read())
+                await value.seek(0)
+    else:
+        digest.update(await request.body())
+    
+    return digest.hexdigest()
+
+
+async def _request_key(request: Request, func_name: str) -> tuple:
+    """Build the dedupe key: (endpoint, caller, Idempotency-Key, body hash)"""
+    body_hash = await _body_digest(request)
+    
+    caller = getattr(request.state, "user_id", None)
+    if not caller:
+        caller = request.client.host if request.client else ""
+    
+    return (func_name, caller, request.headers.get(IDEMPOTENCY_HEADER), body_hash)
+
+
+def idempotent(ttl: int = 600) -> Callable:
+    """
+    Replay the first response for retried requests.
+    
+    With an Idempotency-Key header the response is kept for `ttl` seconds;
+    without one, identical bodies from the same caller are deduped for
+    IMPLICIT_KEY_TTL seconds once answered. A retry that arrives while the
+    first request is still running gets a 409 (the in-progress marker is
+    kept for at least `ttl`, so long runs stay guarded). Failed requests
+    are not cached, so they can be retried, and neither are streamed
+    responses.
+    
+    The wrapped endpoint must take a `request: Request` argument.
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            request: Request = kwargs["request"]
+            key = await _request_key(request, func.__name__)
+            entry_ttl = ttl if key[2] else IMPLICIT_KEY_TTL
+            
+            cached = _responses.get(key)
+            if cached is _IN_PROGRESS:
+                raise HTTPException(
+                    status_code=409,
+                    detail="This request is already being processed. Please wait."
+                )
+            if cached is not None:
+                logger.info("♻️ Replaying response for duplicate %s request", func.__name__)
+                return cached.build() if isinstance(cached, _CachedResponse) else cached
+            
+            # Guard the whole run, which can outlast the implicit-key window
+            _responses.set(key, _IN_PROGRESS, ttl=max(ttl, entry_ttl))
+            try:
+                response = await func(*args, **kwargs)
+            except BaseException:
+                _responses.pop(key)
+                raise
+            
+            # A streamed body can only be sent once, so there is nothing to replay
+            if isinstance(response, StreamingResponse):
+                _responses.pop(key)
+                return response
+            
+            # Cache the unsent snapshot, not the object middleware is about to edit
+            cached = _CachedResponse(response) if isinstance(response, Response) else response
+            _responses.set(key, cached, ttl=entry_ttl)
+            return response
+        
+        return wrapper
+    return decorator
@@ -0,0 +1,114 @@
+"""
+Background Job Queue
+In-process queue for slow work (virtual try-on) - clients poll the job status
+"""
+import asyncio
+import logging
+import secrets
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Concurrent jobs per process
+JOB_QUEUE_WORKERS = 2
+# Jobs (and their results) stay pollable this long after their last update
+JOB_RESULT_TTL = 3600
+JOB_CACHE_SIZE = 1000
+
+
+class JobQueue:
+    """
+    Runs submitted coroutines on a few worker tasks and tracks their status.
+
+    Status moves queued -> processing -> completed | failed. Jobs live in
+    memory, so status is only visible on the worker process that took it.
+    """
+
+    def __init__(self, workers: int = JOB_QUEUE_WORKERS, result_ttl: float = JOB_RESULT_TTL):
+        self.workers = workers
+        self._jobs = TTLCache(maxsize=JOB_CACHE_SIZE, ttl=result_ttl)
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        """Start the worker tasks (call from a running event loop)"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info("✅ Job queue started with %s workers", self.workers)
+
+    async def stop(self) -> None:
+        """Cancel the worker tasks; queued jobs are dropped"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def submit(self, handler: Callable[[], Awaitable[Any]], owner: Optional[str] = None) -> Dict:
+        """
+        Queue a job and return its record without waiting for it.
+
+        Args:
+            handler: Zero-argument coroutine function doing the work
+            owner: User ID allowed to read the job
+
+        Returns:
+            Job record (job_id, status, result, error, ...)
+        """
+        self.start()
+
+        now = time.time()
+        job = {
+            "job_id": secrets.token_hex(8),
+            "status": "queued",
+            "owner": owner,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self._jobs.set(job["job_id"], job)
+        self._queue.put_nowait((job["job_id"], handler))
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Job record, or None if unknown/expired"""
+        return self._jobs.get(job_id)
+
+    def _update(self, job: Dict, **fields) -> None:
+        job.update(fields, updated_at=time.time())
+        # Re-store so the TTL counts from the latest update
+        self._jobs.set(job["job_id"], job)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id, handler = await self._queue.get()
+            try:
+                job = self._jobs.get(job_id)
+                # Only queued jobs run, so a redelivered job never runs twice
+                if job is None or job["status"] != "queued":
+                    continue
+
+                self._update(job, status="processing")
+                try:
+                    result = await handler()
+                    self._update(job, status="completed", result=result)
+                except asyncio.CancelledError:
+                    self._update(job, status="failed", error="Job cancelled")
+                    raise
+                except Exception as e:
+                    # HTTPException carries its message in .detail
+                    error = str(getattr(e, "detail", None) or e)
+                    logger.error("❌ Job %s failed: %s", job_id, error)
+                    self._update(job, status="failed", error=error)
+            finally:
+                self._queue.task_done()
+
+
+# Singleton instance for try-on jobs
+tryon_jobs = JobQueue()
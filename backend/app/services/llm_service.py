@@ -3,18 +3,307 @@ LLM Service - AI Prompt Understanding
 Uses Groq Cloud API with Llama 3.1 for natural language processing
 FREE tier: 14,400 requests/day
 """
+import asyncio
 import json
 import re
 import httpx
-from typing import Dict, Optional
+from typing import Any, Awaitable, Callable, Collection, Dict, List, Optional
 from app.config import settings
 from app.models import ParsedPrompt
+from app.services.cache import AsyncTTLCache, TTLCache
 import logging
 
 logger = logging.getLogger(__name__)
 
 GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
 
+# Groq JSON mode: replies are always a single valid JSON object
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+# Parsed prompts are reused for an hour (same prompt -> same attributes)
+PROMPT_CACHE_SIZE = 512
+PROMPT_CACHE_TTL = 3600
+# Filler words ignored when matching a reworded prompt against the cache
+PROMPT_STOPWORDS = frozenset({
+    "a", "an", "the", "and", "or", "for", "to", "of", "in", "on", "at", "with",
+    "i", "im", "me", "my", "we", "our", "some", "something", "want", "need",
+    "looking", "please", "outfit", "outfits", "wear", "wearing", "like", "would",
+    "is", "am", "are", "be", "it", "that", "this", "go", "going",
+})
+
+# Generated store search queries, keyed by (normalized query, category, gender)
+SEARCH_QUERY_CACHE_SIZE = 512
+SEARCH_QUERY_CACHE_TTL = 3600
+
+# Keyword search queries used when the LLM is unavailable, by (category, gender)
+FALLBACK_SEARCH_QUERY_TEMPLATES = {
+    ("top", "men"): "mens {query} shirt",
+    ("top", "women"): "womens {query} shirt",
+    ("bottom", "men"): "mens {query} pants jeans",
+    ("bottom", "women"): "womens {query} pants jeans",
+}
+
+# Prompt parsing (shared prefix keeps single and batch requests cache-friendly)
+PARSE_SYSTEM_PROMPT = """You are an AI fashion assistant. Analyze outfit prompts and extract structured information.
+
+Extract the following from the user's prompt:
+- mood: emotional tone (relaxed, energetic, confident, etc.)
+- location: where they'll wear it (beach, office, party, gym, etc.)
+- occasion: the event type (casual, formal, party, business, date, etc.)
+- style: fashion style (casual, formal, streetwear, bohemian, etc.)
+- colors: color preferences (bright, dark, pastel, specific colors)
+- season: time of year (summer, winter, spring, fall, all-season)
+- formality: level of formality (casual, semi-formal, formal)
+- keywords: key fashion terms mentioned
+
+Respond ONLY with valid JSON. No other text.
+
+Example input: "Beach party, colorful and relaxed"
+Example output:
+{
+  "mood": "relaxed",
+  "location": "beach",
+  "occasion": "party",
+  "style": "casual",
+  "colors": ["colorful", "bright"],
+  "season": "summer",
+  "formality": "casual",
+  "keywords": ["beach", "party", "colorful", "relaxed", "summer"]
+}"""
+
+PARSE_BATCH_SYSTEM_PROMPT = PARSE_SYSTEM_PROMPT + """
+
+You will receive several numbered prompts. Analyze each one separately and respond
+ONLY with a JSON object of the form {"results": [...]}, containing one object per
+prompt in the same order."""
+
+# Constant system prompts: identical prefixes across requests let the
+# provider reuse its prompt cache; only the user message varies
+GENDER_CLASSIFY_SYSTEM_PROMPT = """You are a STRICT fashion product classifier. Your job is to RIGOROUSLY filter products by gender.
+
+Target gender: {target}
+
+CRITICAL RULES - BE VERY STRICT:
+1. If target is MEN:
+   - EXCLUDE ALL: dresses, skirts, blouses, women's tops, women's jeans, women's pants, lingerie, bras, women's shoes, heels, women's accessories
+   - EXCLUDE products with keywords: "women", "woman", "womens", "ladies", "girl", "girls", "female", "feminine", "maternity"
+   - EXCLUDE unisex items that are typically worn by women (e.g., flowy tops, certain jewelry)
+   - INCLUDE ONLY: men's shirts, men's pants, men's jeans, men's suits, men's accessories, men's shoes
+
+2. If target is WOMEN:
+   - EXCLUDE ALL: men's suits, men's ties, men's dress shirts, men's formal wear, men's specific accessories
+   - EXCLUDE products with keywords: "men", "mens", "man", "male", "gentleman", "boys"
+   - EXCLUDE unisex items that are typically worn by men (e.g., certain men's watches, men's belts)
+   - INCLUDE: dresses, skirts, blouses, women's tops, women's jeans, women's pants, women's shoes, women's accessories
+
+3. When in doubt, EXCLUDE the product. Only include products that are CLEARLY for {target}.
+
+For each product, analyze:
+- Product name/title (most important)
+- Description
+- Category
+- Brand
+
+Return ONLY products that are DEFINITELY for {target}. Be RIGOROUS - exclude anything ambiguous.
+
+Respond with a JSON object holding the indices (0-based) of products that match {target}.
+Example: {{"indices": [0, 2, 4]}} means products at indices 0, 2, and 4 match.
+
+Return ONLY the JSON object, no other text."""
+
+GENDER_CLASSIFY_SYSTEM_PROMPTS = {
+    gender: GENDER_CLASSIFY_SYSTEM_PROMPT.format(target=gender.upper())
+    for gender in ("men", "women")
+}
+
+COMPATIBILITY_SYSTEM_PROMPT = """You are a fashion stylist expert. Analyze if a top and bottom product go well together as an outfit.
+
+Consider:
+1. Style compatibility (casual with casual, formal with formal, etc.)
+2. Color coordination (complementary, matching, or clashing colors)
+3. Occasion appropriateness (both suitable for same occasion)
+4. Aesthetic harmony (do they create a cohesive look?)
+5. Fashion rules and trends
+
+Respond with JSON only:
+{
+  "compatible": true/false,
+  "compatibility_score": 0.0-1.0,
+  "reasoning": "brief explanation why they match or don't match"
+}
+
+Be strict - only mark as compatible if they truly go well together."""
+
+CATEGORY_QUERY_SYSTEM_PROMPT = """You are a fashion search query optimizer. Analyze the user's query and generate the best search terms for the given category and gender.
+
+Determine if the query is:
+1. DIRECT: Specific clothing type (e.g., "blazers", "suits", "jackets", "hoodies", "cardigans")
+2. DESCRIPTIVE: Style/occasion/mood (e.g., "casual summer", "beach party", "formal", "workout")
+
+Rules:
+- If DIRECT: Use the query as-is, just add gender prefix (e.g., "blazers" → "mens blazers")
+- If DESCRIPTIVE: Generate appropriate clothing terms based on context:
+  * For tops: shirt, t-shirt, polo, top, blouse, kurta, etc.
+  * For bottoms: pants, jeans, trousers, shorts, etc.
+  * Choose terms that match the style/occasion described
+
+Respond with JSON only:
+{
+  "is_direct": true/false,
+  "search_query": "final search query with gender prefix"
+}
+
+Example 1 (direct):
+Input: "blazers", category: "top", gender: "men"
+Output: {"is_direct": true, "search_query": "mens blazers"}
+
+Example 2 (descriptive):
+Input: "casual summer", category: "top", gender: "men"
+Output: {"is_direct": false, "search_query": "mens casual summer shirt t-shirt"}
+
+Example 3 (descriptive):
+Input: "beach party", category: "bottom", gender: "women"
+Output: {"is_direct": false, "search_query": "womens beach party pants shorts"}
+
+Return ONLY the JSON, no other text."""
+
+# Keyword gender filter (fallback when the LLM can't classify)
+_MEN_EXCLUDE_RE = re.compile(
+    r"\b(?:women|woman|womens|ladies|girl|girls|dress|dresses|skirt|skirts|blouse|bra"
+    r"|lingerie|maternity|female|feminine)\b",
+    re.IGNORECASE
+)
+_MEN_INCLUDE_RE = re.compile(r"\b(?:men|mens|man|male|gentleman)\b", re.IGNORECASE)
+# Explicit women's terms only; garment words like "dress" also describe men's products
+_MEN_OTHER_GENDER_RE = re.compile(
+    r"\b(?:women|woman|womens|ladies|girl|girls|female|feminine|maternity)\b",
+    re.IGNORECASE
+)
+_WOMEN_EXCLUDE_RE = re.compile(r"\b(?:men|mans|mens|boy|boys|male|gentleman)\b", re.IGNORECASE)
+
+# Keyword prompt parser (fallback when the LLM can't parse), in priority order
+_MOOD_KEYWORDS = (
+    ("relaxed", ("relaxed", "chill", "calm", "easy", "comfortable")),
+    ("energetic", ("energetic", "active", "dynamic", "lively", "sporty")),
+    ("confident", ("confident", "bold", "powerful", "strong")),
+    ("romantic", ("romantic", "soft", "elegant", "date")),
+)
+_LOCATIONS = ("beach", "office", "gym", "party", "home", "outdoor", "indoor", "restaurant", "club")
+_OCCASIONS = ("party", "wedding", "date", "meeting", "casual", "formal", "business", "interview", "dinner")
+_COLOR_WORDS = (
+    "blue", "red", "green", "yellow", "black", "white", "gray", "grey", "pink",
+    "colorful", "bright", "dark", "pastel", "neutral", "navy", "beige", "brown",
+)
+_SEASONS = ("summer", "winter", "spring", "fall", "autumn")
+_FORMALITY_KEYWORDS = (
+    ("formal", ("formal", "business", "professional", "suit", "elegant")),
+    ("semi-formal", ("semi-formal", "smart", "dressy")),
+)
+_STYLE_KEYWORDS = (
+    ("streetwear", ("streetwear", "street", "urban", "hip-hop")),
+    ("bohemian", ("boho", "bohemian", "hippie", "flowy")),
+    ("minimalist", ("minimal", "minimalist", "simple", "clean")),
+    ("preppy", ("preppy", "prepster", "ivy")),
+    ("sporty", ("sporty", "athletic", "gym", "workout")),
+)
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def names_other_gender(text: str, target_gender: str) -> bool:
+    """True if the text names the other gender as whole words (e.g. "Women's" when shopping for men)"""
+    exclude_re = _MEN_OTHER_GENDER_RE if target_gender == "men" else _WOMEN_EXCLUDE_RE
+    return exclude_re.search(text) is not None
+
+
+def _first_keyword(text: Collection[str], keywords: tuple) -> Optional[str]:
+    """First keyword (in priority order) in the text (a string, or a set of its words)"""
+    for keyword in keywords:
+        if keyword in text:
+            return keyword
+    return None
+
+
+def _first_group(text: str, groups: tuple) -> Optional[str]:
+    """Label of the first (label, words) group with a word contained in the text"""
+    for label, words in groups:
+        for word in words:
+            if word in text:
+                return label
+    return None
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalize a prompt for cache lookups (case, punctuation, spacing)"""
+    text = _PUNCTUATION_RE.sub(" ", prompt.lower())
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def _content_words(normalized_prompt: str) -> frozenset:
+    """Words of a normalized prompt that carry meaning (stopwords dropped)"""
+    return frozenset(normalized_prompt.split()) - PROMPT_STOPWORDS
+
+
+class AsyncBatcher:
+    """
+    Coalesce concurrent calls into batched handler calls.
+    
+    Items submitted within max_wait_ms of each other (up to max_batch) are
+    passed to the handler as one list; each caller gets the result at its
+    own position.
+    """
+    
+    def __init__(
+        self,
+        handler: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch: int = 16,
+        max_wait_ms: float = 25
+    ):
+        self.handler = handler
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[tuple] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+    
+    async def submit(self, item: Any) -> Any:
+        """Queue an item and wait for its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+        
+        return await future
+    
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    async def _run(self, batch: List[tuple]):
+        try:
+            results = await self.handler([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
 
 class LLMService:
     """Service for AI prompt understanding using Groq Cloud"""
@@ -27,12 +316,23 @@ class LLMService:
         if not self.is_configured:
             logger.warning("⚠️  GROQ_API_KEY not set - will use fallback parser")
         else:
-            logger.info(f"✅ Groq LLM configured with model: {self.model}")
+            logger.info("✅ Groq LLM configured with model: %s", self.model)
+        
+        self._prompt_cache = TTLCache(maxsize=PROMPT_CACHE_SIZE, ttl=PROMPT_CACHE_TTL)
+        self._search_query_cache = AsyncTTLCache(maxsize=SEARCH_QUERY_CACHE_SIZE, ttl=SEARCH_QUERY_CACHE_TTL)
+        self._prompt_batcher = AsyncBatcher(
+            self._parse_batch,
+            max_batch=max(1, settings.PARSE_BATCH_MAX_SIZE),
+            max_wait_ms=settings.PARSE_BATCH_MAX_WAIT_MS
+        )
     
     async def parse_outfit_prompt(self, prompt: str) -> ParsedPrompt:
         """
         Parse user prompt and extract outfit attributes using Groq
         
+        Concurrent calls are coalesced by the prompt batcher into a single
+        multi-prompt Groq request.
+        
         Args:
             prompt: User's natural language prompt
             
@@ -44,36 +344,87 @@ class LLMService:
             logger.info("Using fallback parser (Groq not configured)")
             return self._fallback_parse(prompt)
         
+        # Prompts with the same content words (reordered, or differing only in
+        # stopwords) skip the LLM round trip; any other differing word may
+        # change the parse ("summer" vs "winter"), so it's a different key
+        normalized = normalize_prompt(prompt)
+        cache_key = _content_words(normalized) or normalized
+        cached = self._prompt_cache.get(cache_key)
+        if cached is not None:
+            logger.info("✅ Parsed prompt from cache")
+            return cached.model_copy(update={"original_prompt": prompt})
+        
+        try:
+            parsed_data = await self._prompt_batcher.submit(prompt)
+        except Exception as e:
+            logger.error("❌ Failed to parse prompt with Groq: %s", e)
+            return self._fallback_parse(prompt)
+        
+        if not parsed_data or not isinstance(parsed_data, dict):
+            return self._fallback_parse(prompt)
+        
+        # Create ParsedPrompt object
+        parsed_prompt = ParsedPrompt(
+            original_prompt=prompt,
+            mood=parsed_data.get('mood'),
+            location=parsed_data.get('location'),
+            occasion=parsed_data.get('occasion'),
+            style=parsed_data.get('style'),
+            colors=parsed_data.get('colors', []),
+            season=parsed_data.get('season'),
+            formality=parsed_data.get('formality'),
+            keywords=parsed_data.get('keywords', [])
+        )
+        
+        # Diagnostic only; the model is formatted lazily if DEBUG is on
+        logger.debug("✅ Parsed prompt via Groq: %s", parsed_prompt)
+        
+        # Only cache real LLM parses, never the keyword fallback
+        self._prompt_cache.set(cache_key, parsed_prompt)
+        return parsed_prompt
+    
+    async def _parse_batch(self, prompts: List[str]) -> List[Optional[Dict]]:
+        """
+        Parse a batch of prompts, in order (None where parsing failed)
+        
+        A single prompt uses the plain request; several prompts share one
+        request and fall back to individual requests if the batch reply
+        doesn't line up.
+        """
+        if len(prompts) == 1:
+            return [await self._request_parse(prompts[0])]
+        
+        numbered = "\n".join(f"{i}. {p}" for i, p in enumerate(prompts, 1))
+        content = await self._groq_chat(
+            PARSE_BATCH_SYSTEM_PROMPT,
+            f"Analyze these {len(prompts)} outfit prompts:\n{numbered}",
+            max_tokens=300 * len(prompts),
+        )
+        
+        if content is not None:
+            data = self._extract_json(content)
+            results = data.get("results") if isinstance(data, dict) else None
+            if isinstance(results, list) and len(results) == len(prompts):
+                logger.info("✅ Parsed %s prompts in one Groq request", len(prompts))
+                return [r if isinstance(r, dict) else None for r in results]
+        
+        logger.warning("Batch parse failed for %s prompts, parsing individually", len(prompts))
+        return list(await asyncio.gather(*(self._request_parse(p) for p in prompts)))
+    
+    async def _request_parse(self, prompt: str) -> Optional[Dict]:
+        """Parse a single prompt with Groq (None on failure)"""
+        content = await self._groq_chat(
+            PARSE_SYSTEM_PROMPT,
+            f"Analyze this outfit prompt: {prompt}",
+            max_tokens=300,
+        )
+        if content is None:
+            return None
+        return self._extract_json(content)
+    
+    async def _groq_chat(self, system_prompt: str, user_content: str, max_tokens: int) -> Optional[str]:
+        """Run a prompt-parsing chat completion, returning the reply text"""
         try:
-            # Prepare system prompt
-            system_prompt = """You are an AI fashion assistant. Analyze outfit prompts and extract structured information.
-
-Extract the following from the user's prompt:
-- mood: emotional tone (relaxed, energetic, confident, etc.)
-- location: where they'll wear it (beach, office, party, gym, etc.)
-- occasion: the event type (casual, formal, party, business, date, etc.)
-- style: fashion style (casual, formal, streetwear, bohemian, etc.)
-- colors: color preferences (bright, dark, pastel, specific colors)
-- season: time of year (summer, winter, spring, fall, all-season)
-- formality: level of formality (casual, semi-formal, formal)
-- keywords: key fashion terms mentioned
-
-Respond ONLY with valid JSON. No other text.
-
-Example input: "Beach party, colorful and relaxed"
-Example output:
-{
-  "mood": "relaxed",
-  "location": "beach",
-  "occasion": "party",
-  "style": "casual",
-  "colors": ["colorful", "bright"],
-  "season": "summer",
-  "formality": "casual",
-  "keywords": ["beach", "party", "colorful", "relaxed", "summer"]
-}"""
-            
-            # Call Groq API
             async with httpx.AsyncClient() as client:
                 response = await client.post(
                     GROQ_API_URL,
@@ -85,60 +436,38 @@ Example output:
                         "model": self.model,
                         "messages": [
                             {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": f"Analyze this outfit prompt: {prompt}"}
+                            {"role": "user", "content": user_content}
                         ],
                         "temperature": 0.3,
-                        "max_tokens": 300
+                        "max_tokens": max_tokens,
+                        "response_format": JSON_RESPONSE_FORMAT
                     },
                     timeout=30.0
                 )
-                
-                if response.status_code != 200:
-                    logger.error(f"Groq API error: {response.status_code} - {response.text}")
-                    return self._fallback_parse(prompt)
-                
-                data = response.json()
-                content = data["choices"][0]["message"]["content"]
             
-            # Extract JSON from response
-            parsed_data = self._extract_json(content)
+            if response.status_code != 200:
+                logger.error("Groq API error: %s - %s", response.status_code, response.text)
+                return None
             
-            # Create ParsedPrompt object
-            parsed_prompt = ParsedPrompt(
-                original_prompt=prompt,
-                mood=parsed_data.get('mood'),
-                location=parsed_data.get('location'),
-                occasion=parsed_data.get('occasion'),
-                style=parsed_data.get('style'),
-                colors=parsed_data.get('colors', []),
-                season=parsed_data.get('season'),
-                formality=parsed_data.get('formality'),
-                keywords=parsed_data.get('keywords', [])
-            )
-            
-            logger.info(f"✅ Parsed prompt via Groq: {parsed_prompt.dict()}")
-            return parsed_prompt
+            data = response.json()
+            return data["choices"][0]["message"]["content"]
             
         except Exception as e:
-            logger.error(f"❌ Failed to parse prompt with Groq: {e}")
-            return self._fallback_parse(prompt)
+            logger.error("❌ Failed to parse prompt with Groq: %s", e)
+            return None
     
     def _extract_json(self, text: str) -> Dict:
-        """Extract JSON from LLM response (handles various formats)"""
+        """Parse an LLM reply (JSON mode guarantees a bare JSON object)"""
         try:
             return json.loads(text)
-        except:
-            # Try to find JSON in text
-            json_match = re.search(r'\{.*\}', text, re.DOTALL)
-            if json_match:
-                try:
-                    return json.loads(json_match.group())
-                except:
-                    pass
-            
-            logger.warning(f"Could not extract JSON from: {text[:100]}")
+        except ValueError:
+            logger.warning("Could not extract JSON from: %s", text[:100])
             return {}
     
+    def fallback_parse(self, prompt: str) -> ParsedPrompt:
+        """Keyword-based parse with no LLM call (for when the LLM parse fails)"""
+        return self._fallback_parse(prompt)
+    
     def _fallback_parse(self, prompt: str) -> ParsedPrompt:
         """Fallback parser using simple keyword matching"""
         prompt_lower = prompt.lower()
@@ -146,71 +475,24 @@ Example output:
         # Simple keyword extraction
         keywords = [word for word in prompt_lower.split() if len(word) > 3]
         
-        # Detect mood
-        mood = None
-        mood_map = {
-            'relaxed': ['relaxed', 'chill', 'calm', 'easy', 'comfortable'],
-            'energetic': ['energetic', 'active', 'dynamic', 'lively', 'sporty'],
-            'confident': ['confident', 'bold', 'powerful', 'strong'],
-            'romantic': ['romantic', 'soft', 'elegant', 'date']
-        }
-        for m, words in mood_map.items():
-            if any(w in prompt_lower for w in words):
-                mood = m
-                break
-        
-        # Detect location
-        location = None
-        locations = ['beach', 'office', 'gym', 'party', 'home', 'outdoor', 'indoor', 'restaurant', 'club']
-        for loc in locations:
-            if loc in prompt_lower:
-                location = loc
-                break
-        
-        # Detect occasion
-        occasion = None
-        occasions = ['party', 'wedding', 'date', 'meeting', 'casual', 'formal', 'business', 'interview', 'dinner']
-        for occ in occasions:
-            if occ in prompt_lower:
-                occasion = occ
-                break
-        
-        # Detect colors
-        colors = []
-        color_words = ['blue', 'red', 'green', 'yellow', 'black', 'white', 'gray', 'grey', 'pink', 
-                      'colorful', 'bright', 'dark', 'pastel', 'neutral', 'navy', 'beige', 'brown']
-        colors = [c for c in color_words if c in prompt_lower]
-        
-        # Detect season
-        season = None
-        seasons = ['summer', 'winter', 'spring', 'fall', 'autumn']
-        for s in seasons:
-            if s in prompt_lower:
-                season = s
-                break
+        # Whole words (punctuation stripped) for the single-word vocabularies,
+        # so e.g. "red" doesn't match "tired" and "date" doesn't match "update"
+        words = frozenset(normalize_prompt(prompt).split())
+        
+        # Detect mood, location, occasion, colors and season
+        mood = _first_group(prompt_lower, _MOOD_KEYWORDS)
+        location = _first_keyword(words, _LOCATIONS)
+        occasion = _first_keyword(words, _OCCASIONS)
+        colors = [c for c in _COLOR_WORDS if c in words]
+        season = _first_keyword(words, _SEASONS)
         
         # Detect formality
-        formality = 'casual'  # default
-        if any(w in prompt_lower for w in ['formal', 'business', 'professional', 'suit', 'elegant']):
-            formality = 'formal'
-        elif any(w in prompt_lower for w in ['semi-formal', 'smart', 'dressy']):
-            formality = 'semi-formal'
+        formality = _first_group(prompt_lower, _FORMALITY_KEYWORDS) or 'casual'  # default
         
         # Detect style
-        style = formality
-        style_map = {
-            'streetwear': ['streetwear', 'street', 'urban', 'hip-hop'],
-            'bohemian': ['boho', 'bohemian', 'hippie', 'flowy'],
-            'minimalist': ['minimal', 'minimalist', 'simple', 'clean'],
-            'preppy': ['preppy', 'prepster', 'ivy'],
-            'sporty': ['sporty', 'athletic', 'gym', 'workout']
-        }
-        for s, words in style_map.items():
-            if any(w in prompt_lower for w in words):
-                style = s
-                break
+        style = _first_group(prompt_lower, _STYLE_KEYWORDS) or formality
         
-        logger.info(f"✅ Fallback parse completed for: {prompt}")
+        logger.info("✅ Fallback parse completed for: %s", prompt)
         
         return ParsedPrompt(
             original_prompt=prompt,
@@ -254,13 +536,14 @@ Example output:
         unique_parts = list(dict.fromkeys(query_parts))
         query = " ".join(unique_parts)
         
-        logger.info(f"Generated search query: {query}")
+        logger.info("Generated search query: %s", query)
         return query
     
     async def classify_product_gender(
         self,
         products: list,
-        target_gender: str
+        target_gender: str,
+        limit: Optional[int] = None
     ) -> list:
         """
         Use LLM to classify products by gender
@@ -268,13 +551,14 @@ Example output:
         Args:
             products: List of product dicts with name, description, category, etc.
             target_gender: 'men' or 'women' - filter to only return products for this gender
+            limit: Stop once this many products matched (remaining batches are skipped)
             
         Returns:
             List of products that match the target gender
         """
         if not self.is_configured:
             logger.warning("Groq not configured - using keyword fallback for gender filtering")
-            return self._fallback_gender_filter(products, target_gender)
+            return self._fallback_gender_filter(products, target_gender)[:limit]
         
         if not products:
             return []
@@ -285,6 +569,10 @@ Example output:
             filtered_products = []
             
             for i in range(0, len(products), batch_size):
+                # Enough matches already - don't classify the rest
+                if limit is not None and len(filtered_products) >= limit:
+                    break
+                
                 batch = products[i:i + batch_size]
                 
                 # Prepare product data for LLM
@@ -298,39 +586,10 @@ Example output:
                     })
                 
                 # Create prompt for LLM
-                system_prompt = f"""You are a STRICT fashion product classifier. Your job is to RIGOROUSLY filter products by gender.
-
-Target gender: {target_gender.upper()}
-
-CRITICAL RULES - BE VERY STRICT:
-1. If target is MEN:
-   - EXCLUDE ALL: dresses, skirts, blouses, women's tops, women's jeans, women's pants, lingerie, bras, women's shoes, heels, women's accessories
-   - EXCLUDE products with keywords: "women", "woman", "womens", "ladies", "girl", "girls", "female", "feminine", "maternity"
-   - EXCLUDE unisex items that are typically worn by women (e.g., flowy tops, certain jewelry)
-   - INCLUDE ONLY: men's shirts, men's pants, men's jeans, men's suits, men's accessories, men's shoes
-
-2. If target is WOMEN:
-   - EXCLUDE ALL: men's suits, men's ties, men's dress shirts, men's formal wear, men's specific accessories
-   - EXCLUDE products with keywords: "men", "mens", "man", "male", "gentleman", "boys"
-   - EXCLUDE unisex items that are typically worn by men (e.g., certain men's watches, men's belts)
-   - INCLUDE: dresses, skirts, blouses, women's tops, women's jeans, women's pants, women's shoes, women's accessories
-
-3. When in doubt, EXCLUDE the product. Only include products that are CLEARLY for {target_gender.upper()}.
-
-For each product, analyze:
-- Product name/title (most important)
-- Description
-- Category
-- Brand
-
-Return ONLY products that are DEFINITELY for {target_gender.upper()}. Be RIGOROUS - exclude anything ambiguous.
-
-Respond with JSON array of indices (0-based) of products that match {target_gender.upper()}.
-Example: [0, 2, 4] means products at indices 0, 2, and 4 match.
-
-Return ONLY the JSON array, no other text."""
+                system_prompt = GENDER_CLASSIFY_SYSTEM_PROMPTS.get(target_gender) or \
+                    GENDER_CLASSIFY_SYSTEM_PROMPT.format(target=target_gender.upper())
                 
-                user_prompt = f"Products to classify:\n{json.dumps(product_data, indent=2)}\n\nReturn array of indices for {target_gender.upper()} products:"
+                user_prompt = f"Products to classify:\n{json.dumps(product_data, indent=2)}\n\nReturn the indices of {target_gender.upper()} products:"
                 
                 # Call Groq API
                 async with httpx.AsyncClient() as client:
@@ -347,13 +606,14 @@ Return ONLY the JSON array, no other text."""
                                 {"role": "user", "content": user_prompt}
                             ],
                             "temperature": 0.1,  # Low temperature for consistent classification
-                            "max_tokens": 200
+                            "max_tokens": 200,
+                            "response_format": JSON_RESPONSE_FORMAT
                         },
                         timeout=30.0
                     )
                     
                     if response.status_code != 200:
-                        logger.error(f"Groq API error for gender classification: {response.status_code}")
+                        logger.error("Groq API error for gender classification: %s", response.status_code)
                         # Fallback to keyword filtering for this batch
                         filtered_products.extend(self._fallback_gender_filter(batch, target_gender))
                         continue
@@ -363,7 +623,7 @@ Return ONLY the JSON array, no other text."""
                     
                     # Extract indices from response
                     try:
-                        # Try to extract JSON array from response
+                        # JSON mode replies {"indices": [...]}
                         parsed_data = self._extract_json(content)
                         
                         # Handle different response formats
@@ -388,45 +648,31 @@ Return ONLY the JSON array, no other text."""
                             filtered_products.extend(self._fallback_gender_filter(batch, target_gender))
                     except Exception as e:
                         # Fallback if JSON parsing fails
-                        logger.warning(f"Could not parse LLM response: {content[:100]} - Error: {e}")
+                        logger.warning("Could not parse LLM response: %s - Error: %s", content[:100], e)
                         filtered_products.extend(self._fallback_gender_filter(batch, target_gender))
             
-            logger.info(f"✅ LLM filtered {len(products)} products → {len(filtered_products)} for {target_gender}")
-            return filtered_products
+            logger.info("✅ LLM filtered %s products → %s for %s", len(products), len(filtered_products), target_gender)
+            return filtered_products[:limit]
             
         except Exception as e:
-            logger.error(f"❌ LLM gender classification failed: {e}")
+            logger.error("❌ LLM gender classification failed: %s", e)
             # Fallback to keyword filtering
-            return self._fallback_gender_filter(products, target_gender)
+            return self._fallback_gender_filter(products, target_gender)[:limit]
     
     def _fallback_gender_filter(self, products: list, target_gender: str) -> list:
-        """Fallback keyword-based gender filtering"""
-        if target_gender == "men":
-            exclude_keywords = [
-                "women", "woman", "womens", "ladies", "girl", "girls",
-                "dress", "dresses", "skirt", "skirts", "blouse", "bra",
-                "lingerie", "maternity", "female", "feminine"
-            ]
-            include_keywords = ["men", "mens", "man", "male", "gentleman"]
-        else:
-            exclude_keywords = ["men", "mans", "mens", "boy", "boys", "male", "gentleman"]
-            include_keywords = []
+        """Fallback keyword-based gender filtering (whole words, so "men" never matches "women")"""
+        exclude_re = _MEN_EXCLUDE_RE if target_gender == "men" else _WOMEN_EXCLUDE_RE
+        include_re = _MEN_INCLUDE_RE if target_gender == "men" else None
         
         filtered = []
         for product in products:
-            name = (product.get("name", "") or "").lower()
-            description = (product.get("description", "") or "").lower()
-            full_text = name + " " + description
+            full_text = f"{product.get('name', '') or ''} {product.get('description', '') or ''}"
             
-            has_excluded = any(kw in full_text for kw in exclude_keywords)
-            
-            if target_gender == "men":
-                has_men_keyword = any(kw in full_text for kw in include_keywords)
-                if not has_excluded and has_men_keyword:
-                    filtered.append(product)
-            else:
-                if not has_excluded:
-                    filtered.append(product)
+            if exclude_re.search(full_text):
+                continue
+            if include_re is not None and not include_re.search(full_text):
+                continue
+            filtered.append(product)
         
         return filtered
     
@@ -471,24 +717,6 @@ Return ONLY the JSON array, no other text."""
             }
             
             # Create prompt for LLM
-            system_prompt = """You are a fashion stylist expert. Analyze if a top and bottom product go well together as an outfit.
-
-Consider:
-1. Style compatibility (casual with casual, formal with formal, etc.)
-2. Color coordination (complementary, matching, or clashing colors)
-3. Occasion appropriateness (both suitable for same occasion)
-4. Aesthetic harmony (do they create a cohesive look?)
-5. Fashion rules and trends
-
-Respond with JSON only:
-{
-  "compatible": true/false,
-  "compatibility_score": 0.0-1.0,
-  "reasoning": "brief explanation why they match or don't match"
-}
-
-Be strict - only mark as compatible if they truly go well together."""
-            
             user_prompt_text = f"""Top Product:
 Name: {top_info['name']}
 Description: {top_info['description']}
@@ -518,17 +746,18 @@ Brand: {bottom_info['brand']}
                     json={
                         "model": self.model,
                         "messages": [
-                            {"role": "system", "content": system_prompt},
+                            {"role": "system", "content": COMPATIBILITY_SYSTEM_PROMPT},
                             {"role": "user", "content": user_prompt_text}
                         ],
                         "temperature": 0.2,  # Low temperature for consistent evaluation
-                        "max_tokens": 200
+                        "max_tokens": 200,
+                        "response_format": JSON_RESPONSE_FORMAT
                     },
                     timeout=30.0
                 )
                 
                 if response.status_code != 200:
-                    logger.error(f"Groq API error for compatibility check: {response.status_code}")
+                    logger.error("Groq API error for compatibility check: %s", response.status_code)
                     return self._fallback_compatibility_check(top, bottom)
                 
                 data = response.json()
@@ -546,7 +775,7 @@ Brand: {bottom_info['brand']}
                     # Clamp score to 0-1
                     score = max(0.0, min(1.0, score))
                     
-                    logger.info(f"✅ Compatibility check: {compatible} (score: {score:.2f}) - {reasoning[:50]}")
+                    logger.info("✅ Compatibility check: %s (score: %.2f) - %s", compatible, score, reasoning[:50])
                     
                     return {
                         "compatible": compatible,
@@ -554,11 +783,11 @@ Brand: {bottom_info['brand']}
                         "reasoning": reasoning
                     }
                 except Exception as e:
-                    logger.warning(f"Could not parse compatibility response: {content[:100]} - Error: {e}")
+                    logger.warning("Could not parse compatibility response: %s - Error: %s", content[:100], e)
                     return self._fallback_compatibility_check(top, bottom)
                     
         except Exception as e:
-            logger.error(f"❌ LLM compatibility check failed: {e}")
+            logger.error("❌ LLM compatibility check failed: %s", e)
             return self._fallback_compatibility_check(top, bottom)
     
     def _fallback_compatibility_check(self, top: Dict, bottom: Dict) -> Dict[str, any]:
@@ -612,6 +841,10 @@ Brand: {bottom_info['brand']}
         Generate optimized search query for a specific category (tops/bottoms)
         Uses LLM to detect if query is direct clothing type or descriptive, then generates appropriate terms
         
+        Both stores ask for the same (query, category, gender) during a mixed or
+        multi-store browse, so results are cached and concurrent identical
+        calls share one Groq request.
+        
         Args:
             user_query: User's search query (e.g., "blazers", "casual summer", "beach party")
             category: "top" or "bottom"
@@ -622,46 +855,22 @@ Brand: {bottom_info['brand']}
         """
         if not self.is_configured:
             # Fallback: simple logic
-            gender_prefix = "mens" if gender == "men" else "womens"
-            if category == "top":
-                return f"{gender_prefix} {user_query} shirt".strip()
-            else:
-                return f"{gender_prefix} {user_query} pants jeans".strip()
+            return self._fallback_search_query(user_query, category, gender)
         
+        search_query = await self._search_query_cache.get_or_load(
+            (normalize_prompt(user_query), category, gender),
+            lambda: self._request_search_query(user_query, category, gender)
+        )
+        return search_query or self._fallback_search_query(user_query, category, gender)
+    
+    def _fallback_search_query(self, user_query: str, category: str, gender: str) -> str:
+        """Keyword search query used when the LLM is unavailable"""
+        key = ("top" if category == "top" else "bottom", "men" if gender == "men" else "women")
+        return FALLBACK_SEARCH_QUERY_TEMPLATES[key].format(query=user_query).strip()
+    
+    async def _request_search_query(self, user_query: str, category: str, gender: str) -> Optional[str]:
+        """Ask Groq for a category search query (None if the request or parse fails)"""
         try:
-            system_prompt = f"""You are a fashion search query optimizer. Analyze the user's query and generate the best search terms for {category} products ({gender}).
-
-Determine if the query is:
-1. DIRECT: Specific clothing type (e.g., "blazers", "suits", "jackets", "hoodies", "cardigans")
-2. DESCRIPTIVE: Style/occasion/mood (e.g., "casual summer", "beach party", "formal", "workout")
-
-Rules:
-- If DIRECT: Use the query as-is, just add gender prefix (e.g., "blazers" → "mens blazers")
-- If DESCRIPTIVE: Generate appropriate clothing terms based on context:
-  * For tops: shirt, t-shirt, polo, top, blouse, kurta, etc.
-  * For bottoms: pants, jeans, trousers, shorts, etc.
-  * Choose terms that match the style/occasion described
-
-Respond with JSON only:
-{{
-  "is_direct": true/false,
-  "search_query": "final search query with gender prefix"
-}}
-
-Example 1 (direct):
-Input: "blazers", category: "top", gender: "men"
-Output: {{"is_direct": true, "search_query": "mens blazers"}}
-
-Example 2 (descriptive):
-Input: "casual summer", category: "top", gender: "men"
-Output: {{"is_direct": false, "search_query": "mens casual summer shirt t-shirt"}}
-
-Example 3 (descriptive):
-Input: "beach party", category: "bottom", gender: "women"
-Output: {{"is_direct": false, "search_query": "womens beach party pants shorts"}}
-
-Return ONLY the JSON, no other text."""
-            
             user_prompt = f"User query: {user_query}\nCategory: {category}\nGender: {gender}\n\nGenerate search query:"
             
             # Call Groq API
@@ -675,23 +884,19 @@ Return ONLY the JSON, no other text."""
                     json={
                         "model": self.model,
                         "messages": [
-                            {"role": "system", "content": system_prompt},
+                            {"role": "system", "content": CATEGORY_QUERY_SYSTEM_PROMPT},
                             {"role": "user", "content": user_prompt}
                         ],
                         "temperature": 0.2,
-                        "max_tokens": 150
+                        "max_tokens": 150,
+                        "response_format": JSON_RESPONSE_FORMAT
                     },
                     timeout=30.0
                 )
                 
                 if response.status_code != 200:
-                    logger.error(f"Groq API error for search query generation: {response.status_code}")
-                    # Fallback
-                    gender_prefix = "mens" if gender == "men" else "womens"
-                    if category == "top":
-                        return f"{gender_prefix} {user_query} shirt".strip()
-                    else:
-                        return f"{gender_prefix} {user_query} pants jeans".strip()
+                    logger.error("Groq API error for search query generation: %s", response.status_code)
+                    return None
                 
                 data = response.json()
                 content = data["choices"][0]["message"]["content"]
@@ -702,27 +907,17 @@ Return ONLY the JSON, no other text."""
                     search_query = parsed_data.get("search_query", "")
                     
                     if search_query:
-                        logger.info(f"✅ Generated search query: {search_query} (direct: {parsed_data.get('is_direct', False)})")
+                        logger.info("✅ Generated search query: %s (direct: %s)", search_query, parsed_data.get('is_direct', False))
                         return search_query
                     else:
                         raise ValueError("No search_query in response")
                 except Exception as e:
-                    logger.warning(f"Could not parse LLM response: {content[:100]} - Error: {e}")
-                    # Fallback
-                    gender_prefix = "mens" if gender == "men" else "womens"
-                    if category == "top":
-                        return f"{gender_prefix} {user_query} shirt".strip()
-                    else:
-                        return f"{gender_prefix} {user_query} pants jeans".strip()
+                    logger.warning("Could not parse LLM response: %s - Error: %s", content[:100], e)
+                    return None
                         
         except Exception as e:
-            logger.error(f"❌ LLM search query generation failed: {e}")
-            # Fallback
-            gender_prefix = "mens" if gender == "men" else "womens"
-            if category == "top":
-                return f"{gender_prefix} {user_query} shirt".strip()
-            else:
-                return f"{gender_prefix} {user_query} pants jeans".strip()
+            logger.error("❌ LLM search query generation failed: %s", e)
+            return None
     
     async def health_check(self) -> Dict[str, str]:
         """Check if LLM service is healthy"""
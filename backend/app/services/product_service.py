@@ -12,6 +12,16 @@ from app.services.llm_service import llm_service
 logger = logging.getLogger(__name__)
 
 
+def _compatibility_info(product: ProductItem) -> Dict:
+    """The product fields the LLM compatibility check looks at"""
+    return {
+        "name": product.name,
+        "description": product.description or "",
+        "category": product.category or "",
+        "brand": product.brand or ""
+    }
+
+
 class ProductService:
     """Service for creating outfit combinations"""
     
@@ -42,24 +52,15 @@ class ProductService:
             for j, bottom in enumerate(bottoms[:3]):
                 potential_combos.append((top, bottom, i, j))
         
+        # Project each product once (it appears in up to 3 combinations)
+        top_infos = [_compatibility_info(top) for top in tops[:3]]
+        bottom_infos = [_compatibility_info(bottom) for bottom in bottoms[:3]]
+        
         # Check compatibility for all combinations in parallel (batch)
-        compatibility_tasks = []
-        for top, bottom, i, j in potential_combos:
-            top_dict = {
-                "name": top.name,
-                "description": top.description or "",
-                "category": top.category or "",
-                "brand": top.brand or ""
-            }
-            bottom_dict = {
-                "name": bottom.name,
-                "description": bottom.description or "",
-                "category": bottom.category or "",
-                "brand": bottom.brand or ""
-            }
-            compatibility_tasks.append(
-                llm_service.check_outfit_compatibility(top_dict, bottom_dict, user_prompt)
-            )
+        compatibility_tasks = [
+            llm_service.check_outfit_compatibility(top_infos[i], bottom_infos[j], user_prompt)
+            for _, _, i, j in potential_combos
+        ]
         
         # Run all compatibility checks in parallel
         compatibility_results = await asyncio.gather(*compatibility_tasks)
@@ -102,7 +103,7 @@ class ProductService:
         combinations.sort(key=lambda x: x.match_score, reverse=True)
         
         result = combinations[:max_combinations]
-        logger.info(f"✅ Created {len(result)} outfit combinations (LLM compatibility checked)")
+        logger.info("✅ Created %s outfit combinations (LLM compatibility checked)", len(result))
         return result
     
     async def create_mixed_outfit_combinations(
@@ -142,7 +143,7 @@ class ProductService:
         asos_bottoms = [b for b in bottoms if get_store(b) == "asos"]
         amazon_bottoms = [b for b in bottoms if get_store(b) == "amazon"]
         
-        logger.info(f"📦 Mix sources: ASOS({len(asos_tops)}T/{len(asos_bottoms)}B) + Amazon({len(amazon_tops)}T/{len(amazon_bottoms)}B)")
+        logger.info("📦 Mix sources: ASOS(%sT/%sB) + Amazon(%sT/%sB)", len(asos_tops), len(asos_bottoms), len(amazon_tops), len(amazon_bottoms))
         
         # Collect all potential combinations
         potential_combos = []
@@ -166,24 +167,18 @@ class ProductService:
             for bottom in amazon_bottoms[:1]:
                 potential_combos.append((top, bottom, 0))
         
+        # Project each product once, keyed by identity (products repeat across combos)
+        infos = {}
+        for top, bottom, _ in potential_combos:
+            for product in (top, bottom):
+                if id(product) not in infos:
+                    infos[id(product)] = _compatibility_info(product)
+        
         # Check compatibility for all combinations in parallel
-        compatibility_tasks = []
-        for top, bottom, cross_store_bonus in potential_combos:
-            top_dict = {
-                "name": top.name,
-                "description": top.description or "",
-                "category": top.category or "",
-                "brand": top.brand or ""
-            }
-            bottom_dict = {
-                "name": bottom.name,
-                "description": bottom.description or "",
-                "category": bottom.category or "",
-                "brand": bottom.brand or ""
-            }
-            compatibility_tasks.append(
-                llm_service.check_outfit_compatibility(top_dict, bottom_dict, user_prompt)
-            )
+        compatibility_tasks = [
+            llm_service.check_outfit_compatibility(infos[id(top)], infos[id(bottom)], user_prompt)
+            for top, bottom, _ in potential_combos
+        ]
         
         # Run all compatibility checks in parallel
         compatibility_results = await asyncio.gather(*compatibility_tasks)
@@ -223,7 +218,7 @@ class ProductService:
         combinations.sort(key=lambda x: x.match_score, reverse=True)
         
         result = combinations[:max_combinations]
-        logger.info(f"✅ Created {len(result)} MIXED outfit combinations (LLM compatibility checked)")
+        logger.info("✅ Created %s MIXED outfit combinations (LLM compatibility checked)", len(result))
         return result
 
 
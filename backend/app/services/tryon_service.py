@@ -14,11 +14,10 @@ from typing import Optional, Tuple
 import logging
 import time
 import asyncio
-import requests
-import replicate
 
 from app.config import settings
 from app.models import OutfitCombination
+from app.services.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +32,18 @@ cloudinary.config(
 REPLICATE_MODEL = "cuuupid/idm-vton"
 REPLICATE_MODEL_VERSION = "cuuupid/idm-vton:0513734a452173b8173e907e3a59d19a36266e55b48528559432bd21c7d7e985"
 
+# Shared HTTP client settings (image downloads, result fetches)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+
+# Max concurrent IDM-VTON runs against Replicate (per process)
+REPLICATE_MAX_CONCURRENCY = 8
+
+# Extracted garments by (product image URL, clothing type); reused while the
+# source answers a conditional GET with 304 Not Modified
+GARMENT_CACHE_SIZE = 512
+GARMENT_CACHE_TTL = 24 * 3600
+
 
 class VirtualTryOnService:
     """
@@ -51,6 +62,11 @@ class VirtualTryOnService:
         self.runpod_api_key = None
         self.runpod_base_url = None
         
+        # Pooled client reused across requests (created on first use)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._replicate_slots = asyncio.Semaphore(REPLICATE_MAX_CONCURRENCY)
+        self._garment_cache = TTLCache(maxsize=GARMENT_CACHE_SIZE, ttl=GARMENT_CACHE_TTL)
+        
         # Set environment variable for replicate SDK
         if self.replicate_token:
             os.environ['REPLICATE_API_TOKEN'] = self.replicate_token
@@ -58,35 +74,54 @@ class VirtualTryOnService:
         else:
             logger.warning("⚠️  Replicate API not configured, will use fallback preview")
     
+    # ==================== HTTP CLIENT ====================
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """Shared client, so repeat calls skip the TCP/TLS handshake"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+        return self._client
+    
+    async def aclose(self):
+        """Close the shared HTTP client (call on shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
     # ==================== CLOUDINARY UPLOAD ====================
     
+    def _encode_and_upload(self, image: Image.Image, public_id: str) -> dict:
+        """Encode and upload an image (blocking; run via asyncio.to_thread)"""
+        from app.services.garment_extractor import encode_for_upload
+        
+        # Convert to bytes (JPEG, or lossless WebP if transparent)
+        buffer = encode_for_upload(image)
+        
+        return cloudinary.uploader.upload(
+            buffer,
+            public_id=public_id,
+            resource_type="image",
+            overwrite=True
+        )
+    
     async def _upload_to_cloudinary(self, image: Image.Image, prefix: str = "extracted") -> Optional[str]:
         """Upload a PIL Image to Cloudinary and return the URL"""
         try:
-            import uuid
-            
-            # Convert to bytes
-            buffer = io.BytesIO()
-            image.save(buffer, format="PNG")
-            buffer.seek(0)
+            import secrets
             
             # Generate unique ID
-            public_id = f"garments/{prefix}_{uuid.uuid4().hex[:8]}"
-            
-            # Upload to Cloudinary
-            result = cloudinary.uploader.upload(
-                buffer,
-                public_id=public_id,
-                resource_type="image",
-                overwrite=True
-            )
+            public_id = f"garments/{prefix}_{secrets.token_hex(4)}"
+            
+            # Encoding and the SDK upload both block, so gathered uploads
+            # (top and bottom garments) only overlap off the event loop
+            result = await asyncio.to_thread(self._encode_and_upload, image, public_id)
             
             url = result.get('secure_url')
-            logger.info(f"Uploaded to Cloudinary: {url[:60]}...")
+            logger.info("Uploaded to Cloudinary: %s...", url[:60])
             return url
             
         except Exception as e:
-            logger.error(f"Failed to upload to Cloudinary: {e}")
+            logger.error("Failed to upload to Cloudinary: %s", e)
             return None
     
     # ==================== IMAGE PROCESSING ====================
@@ -94,16 +129,15 @@ class VirtualTryOnService:
     async def download_image(self, url: str) -> Image.Image:
         """Download image from URL"""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, timeout=30.0)
-                response.raise_for_status()
-                image = Image.open(io.BytesIO(response.content))
-                # Convert to RGB if necessary
-                if image.mode != 'RGB':
-                    image = image.convert('RGB')
-                return image
+            response = await self._get_client().get(url, timeout=30.0)
+            response.raise_for_status()
+            image = Image.open(io.BytesIO(response.content))
+            # Convert to RGB if necessary
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            return image
         except Exception as e:
-            logger.error(f"Failed to download image from {url}: {e}")
+            logger.error("Failed to download image from %s: %s", url, e)
             raise
     
     def image_to_base64(self, image: Image.Image) -> str:
@@ -160,6 +194,7 @@ class VirtualTryOnService:
     ) -> Optional[str]:
         """Synchronous Replicate call with retry logic for rate limits"""
         import time as sync_time
+        import replicate
         
         for attempt in range(max_retries):
             try:
@@ -184,14 +219,14 @@ class VirtualTryOnService:
                 # Handle rate limiting (429 errors)
                 if "429" in error_str or "rate limit" in error_str.lower() or "throttled" in error_str.lower():
                     wait_time = (attempt + 1) * 10  # 10s, 20s, 30s
-                    logger.warning(f"Rate limited (attempt {attempt + 1}/{max_retries}), waiting {wait_time}s...")
+                    logger.warning("Rate limited (attempt %s/%s), waiting %ss...", attempt + 1, max_retries, wait_time)
                     sync_time.sleep(wait_time)
                     continue
                 else:
-                    logger.error(f"Replicate call failed: {e}")
+                    logger.error("Replicate call failed: %s", e)
                     return None
         
-        logger.error(f"Replicate call failed after {max_retries} retries due to rate limiting")
+        logger.error("Replicate call failed after %s retries due to rate limiting", max_retries)
         return None
     
     async def generate_tryon_replicate(
@@ -219,43 +254,109 @@ class VirtualTryOnService:
             return None, None
         
         try:
-            logger.info(f"Generating try-on with IDM-VTON (category: {category})...")
-            logger.info(f"  Human: {person_image_url[:80]}...")
-            logger.info(f"  Garment: {garment_image_url[:80]}...")
+            logger.info("Generating try-on with IDM-VTON (category: %s)...", category)
+            logger.info("  Human: %s...", person_image_url[:80])
+            logger.info("  Garment: %s...", garment_image_url[:80])
             
-            # Run synchronous replicate call in executor
+            # Run synchronous replicate call in executor (capped per process)
             loop = asyncio.get_event_loop()
-            result_url = await loop.run_in_executor(
-                None,
-                self._run_replicate_sync,
-                person_image_url,
-                garment_image_url,
-                category,
-                garment_description
-            )
+            async with self._replicate_slots:
+                result_url = await loop.run_in_executor(
+                    None,
+                    self._run_replicate_sync,
+                    person_image_url,
+                    garment_image_url,
+                    category,
+                    garment_description
+                )
             
             if not result_url:
                 logger.error("IDM-VTON returned no result")
                 return None, None
             
-            logger.info(f"✅ IDM-VTON result: {result_url[:60]}...")
+            logger.info("✅ IDM-VTON result: %s...", result_url[:60])
             
             # Download result image
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.get(result_url)
-                result_image = Image.open(io.BytesIO(response.content))
+            response = await self._get_client().get(result_url)
+            result_image = Image.open(io.BytesIO(response.content))
             
             logger.info("✅ IDM-VTON try-on successful!")
             return result_image, result_url
                 
         except Exception as e:
-            logger.error(f"IDM-VTON try-on failed: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
+            logger.exception("IDM-VTON try-on failed: %s", e)
             return None, None
     
     # ==================== TWO-PASS FULL OUTFIT ====================
     
+    async def _prepare_garment(
+        self,
+        image_url: str,
+        clothing_type: str,
+        label: str
+    ) -> Optional[str]:
+        """
+        Get a Cloudinary URL for a garment that Replicate can access
+        
+        Tries extraction first (improves results), then falls back to
+        uploading the raw image.
+        
+        Args:
+            image_url: Product image URL
+            clothing_type: "topwear" or "bottomwear" for the segmentation model
+            label: "top" or "bottom" (logging and Cloudinary folder)
+            
+        Returns:
+            Cloudinary URL, or None if the image couldn't be fetched/uploaded
+        """
+        from app.services.garment_extractor import garment_extractor
+        
+        # Same product image as before and unchanged at the source: skip extraction
+        cache_key = (image_url, clothing_type)
+        cached = self._garment_cache.get(cache_key)
+        if cached is not None:
+            if await garment_extractor.is_source_unchanged(image_url, cached["validators"]):
+                logger.info("♻️ %s garment unchanged, reusing extraction", label.capitalize())
+                return cached["cloudinary_url"]
+            self._garment_cache.pop(cache_key)
+        
+        try:
+            logger.info("Extracting %s garment using Replicate clothing-segmentation...", label)
+            extracted = await garment_extractor.extract_from_url(
+                image_url,
+                clothing_type=clothing_type,
+                prefer_quality=settings.GARMENT_EXTRACTION_PREFER_QUALITY
+            )
+            if extracted:
+                # Upload to Cloudinary for Replicate access
+                cloudinary_url = await self._upload_to_cloudinary(extracted, f"extracted_{label}")
+                if cloudinary_url:
+                    logger.info("✅ %s garment extracted and uploaded", label.capitalize())
+                    # Only sources with validators can be revalidated cheaply
+                    validators = garment_extractor.source_validators(image_url)
+                    if validators:
+                        self._garment_cache.set(
+                            cache_key, {"cloudinary_url": cloudinary_url, "validators": validators}
+                        )
+                    return cloudinary_url
+        except Exception as e:
+            logger.warning("Garment extraction failed for %s: %s", label, e)
+        
+        # FALLBACK: If extraction failed, download and upload raw image to Cloudinary
+        # This ensures Replicate can access it (ASOS/other sites block direct access)
+        logger.info("Uploading %s image to Cloudinary (no extraction)...", label.upper())
+        image = await garment_extractor.download_image(image_url)
+        if not image:
+            logger.error("Failed to download %s image", label)
+            return None
+        
+        cloudinary_url = await self._upload_to_cloudinary(image, f"raw_{label}")
+        if cloudinary_url:
+            logger.info("✅ %s image uploaded to Cloudinary", label.capitalize())
+        else:
+            logger.error("Failed to upload %s image to Cloudinary", label)
+        return cloudinary_url
+    
     async def generate_full_outfit_tryon(
         self,
         model_image_url: str,
@@ -283,70 +384,14 @@ class VirtualTryOnService:
             
             # IMPORTANT: Always upload images to Cloudinary for Replicate access
             # E-commerce sites like ASOS block direct access (403 errors)
-            extracted_top_url = None
-            extracted_bottom_url = None
-            
-            from app.services.garment_extractor import garment_extractor
-            
-            # Try extraction first (improves results), but ALWAYS ensure Cloudinary upload
-            try:
-                logger.info("Extracting garments using Replicate clothing-segmentation...")
-                
-                # Extract top garment (using Replicate's clothing segmentation)
-                top_extracted = await garment_extractor.extract_from_url(
-                    top_image_url, 
-                    clothing_type="topwear"  # Specify we want top clothing
-                )
-                if top_extracted:
-                    # Upload to Cloudinary for Replicate access
-                    top_cloudinary_url = await self._upload_to_cloudinary(top_extracted, "extracted_top")
-                    if top_cloudinary_url:
-                        extracted_top_url = top_cloudinary_url
-                        logger.info(f"✅ Top garment extracted and uploaded")
-                
-                # Extract bottom garment (using Replicate's clothing segmentation)
-                bottom_extracted = await garment_extractor.extract_from_url(
-                    bottom_image_url,
-                    clothing_type="bottomwear"  # Specify we want bottom clothing
-                )
-                if bottom_extracted:
-                    bottom_cloudinary_url = await self._upload_to_cloudinary(bottom_extracted, "extracted_bottom")
-                    if bottom_cloudinary_url:
-                        extracted_bottom_url = bottom_cloudinary_url
-                        logger.info(f"✅ Bottom garment extracted and uploaded")
-                        
-            except Exception as e:
-                logger.warning(f"Garment extraction failed: {e}")
-            
-            # FALLBACK: If extraction failed, download and upload raw images to Cloudinary
-            # This ensures Replicate can access them (ASOS/other sites block direct access)
-            if not extracted_top_url:
-                logger.info("Uploading TOP image to Cloudinary (no extraction)...")
-                top_image = await garment_extractor.download_image(top_image_url)
-                if top_image:
-                    extracted_top_url = await self._upload_to_cloudinary(top_image, "raw_top")
-                    if extracted_top_url:
-                        logger.info(f"✅ Top image uploaded to Cloudinary")
-                    else:
-                        logger.error("Failed to upload top image to Cloudinary")
-                        return None
-                else:
-                    logger.error("Failed to download top image")
-                    return None
+            # Top and bottom are independent, so prepare both at once
+            extracted_top_url, extracted_bottom_url = await asyncio.gather(
+                self._prepare_garment(top_image_url, "topwear", "top"),
+                self._prepare_garment(bottom_image_url, "bottomwear", "bottom"),
+            )
             
-            if not extracted_bottom_url:
-                logger.info("Uploading BOTTOM image to Cloudinary (no extraction)...")
-                bottom_image = await garment_extractor.download_image(bottom_image_url)
-                if bottom_image:
-                    extracted_bottom_url = await self._upload_to_cloudinary(bottom_image, "raw_bottom")
-                    if extracted_bottom_url:
-                        logger.info(f"✅ Bottom image uploaded to Cloudinary")
-                    else:
-                        logger.error("Failed to upload bottom image to Cloudinary")
-                        return None
-                else:
-                    logger.error("Failed to download bottom image")
-                    return None
+            if not extracted_top_url or not extracted_bottom_url:
+                return None
             
             # Small delay to respect rate limits (extraction used API calls)
             logger.info("Waiting 5s before IDM-VTON to respect rate limits...")
@@ -391,9 +436,7 @@ class VirtualTryOnService:
             return pass2_image
             
         except Exception as e:
-            logger.error(f"Two-pass generation failed: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
+            logger.exception("Two-pass generation failed: %s", e)
             return None
     
     # ==================== RUNPOD INTEGRATION ====================
@@ -462,7 +505,7 @@ class VirtualTryOnService:
                 return None
                 
         except Exception as e:
-            logger.error(f"RunPod generation failed: {e}")
+            logger.error("RunPod generation failed: %s", e)
             return None
     
     # ==================== SIMPLE FALLBACK ====================
@@ -595,12 +638,12 @@ class VirtualTryOnService:
             result_data_url = self.image_to_data_url(result_image)
             
             generation_time = time.time() - start_time
-            logger.info(f"✅ Outfit image generated in {generation_time:.2f}s")
+            logger.info("✅ Outfit image generated in %.2fs", generation_time)
             
             return result_data_url
             
         except Exception as e:
-            logger.error(f"❌ Failed to generate outfit image: {e}")
+            logger.error("❌ Failed to generate outfit image: %s", e)
             return None
     
     # ==================== BATCH GENERATION ====================
@@ -629,13 +672,13 @@ class VirtualTryOnService:
         urls = []
         for result in results:
             if isinstance(result, Exception):
-                logger.error(f"Generation failed: {result}")
+                logger.error("Generation failed: %s", result)
                 urls.append(None)
             else:
                 urls.append(result)
         
         success_count = sum(1 for url in urls if url is not None)
-        logger.info(f"Generated {success_count}/{len(outfits)} outfit images")
+        logger.info("Generated %s/%s outfit images", success_count, len(outfits))
         
         return urls
 
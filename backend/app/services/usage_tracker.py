@@ -7,9 +7,11 @@ Usage Tracking Service
 import sqlite3
 import os
 from datetime import datetime
-from typing import Dict
+from typing import Dict, Optional
 import logging
 
+from app.services.cache import TTLCache
+
 logger = logging.getLogger(__name__)
 
 # ============ LIMITS (CHANGE THESE) ============
@@ -26,17 +28,32 @@ GLOBAL_TRYON_LIMIT = 50     # Total try-ons allowed (all users combined)
 DB_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "usage.db")
 
 
+# Shared connection, opened once per process
+_connection: Optional[sqlite3.Connection] = None
+
+
 def _get_connection():
-    """Get database connection"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get the shared database connection"""
+    global _connection
+    if _connection is None:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # WAL lets readers proceed during a write and NORMAL skips the fsync
+        # on every commit (still durable at checkpoint time)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _connection = conn
+    return _connection
 
 
 def init_usage_db():
     """Initialize the usage database"""
     conn = _get_connection()
     try:
+        # sqlite3 does not open implicit transactions for DDL, so batch the
+        # schema setup into one explicit transaction (a single commit)
+        conn.execute("BEGIN")
+        
         # Per-user usage table
         conn.execute("""
             CREATE TABLE IF NOT EXISTS user_usage (
@@ -53,6 +70,7 @@ def init_usage_db():
                 id INTEGER PRIMARY KEY CHECK (id = 1),
                 total_searches INTEGER DEFAULT 0,
                 total_tryons INTEGER DEFAULT 0,
+                total_users INTEGER DEFAULT 0,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
@@ -63,142 +81,220 @@ def init_usage_db():
             VALUES (1, 0, 0)
         """)
         
+        # Databases created before total_users existed: add it and backfill once
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(global_usage)")}
+        if "total_users" not in columns:
+            conn.execute("ALTER TABLE global_usage ADD COLUMN total_users INTEGER DEFAULT 0")
+            conn.execute("""
+                UPDATE global_usage SET total_users = (SELECT COUNT(*) FROM user_usage)
+                WHERE id = 1
+            """)
+        
+        # Keep total_users in step with user_usage so stats never need COUNT(*)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS user_usage_count_insert
+            AFTER INSERT ON user_usage
+            BEGIN
+                UPDATE global_usage SET total_users = total_users + 1 WHERE id = 1;
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS user_usage_count_delete
+            AFTER DELETE ON user_usage
+            BEGIN
+                UPDATE global_usage SET total_users = total_users - 1 WHERE id = 1;
+            END
+        """)
+        
         conn.commit()
         logger.info("✅ Usage database initialized")
     except Exception as e:
-        logger.error(f"Failed to init usage db: {e}")
-    finally:
-        conn.close()
+        logger.error("Failed to init usage db: %s", e)
+        conn.rollback()
 
 
 # Initialize on module load
 init_usage_db()
 
 
+def _global_usage_from_totals(total_searches: int, total_tryons: int) -> Dict:
+    """Build the global usage dict from the raw counters"""
+    return {
+        "total_searches": total_searches,
+        "total_tryons": total_tryons,
+        "searches_remaining": max(0, GLOBAL_SEARCH_LIMIT - total_searches),
+        "tryons_remaining": max(0, GLOBAL_TRYON_LIMIT - total_tryons),
+        "global_search_limit": GLOBAL_SEARCH_LIMIT,
+        "global_tryon_limit": GLOBAL_TRYON_LIMIT,
+        "searches_available": total_searches < GLOBAL_SEARCH_LIMIT,
+        "tryons_available": total_tryons < GLOBAL_TRYON_LIMIT,
+    }
+
+
 def get_global_usage() -> Dict:
     """Get global usage stats"""
     conn = _get_connection()
-    try:
-        row = conn.execute("SELECT * FROM global_usage WHERE id = 1").fetchone()
-        if row:
-            total_searches = row["total_searches"]
-            total_tryons = row["total_tryons"]
-            return {
-                "total_searches": total_searches,
-                "total_tryons": total_tryons,
-                "searches_remaining": max(0, GLOBAL_SEARCH_LIMIT - total_searches),
-                "tryons_remaining": max(0, GLOBAL_TRYON_LIMIT - total_tryons),
-                "global_search_limit": GLOBAL_SEARCH_LIMIT,
-                "global_tryon_limit": GLOBAL_TRYON_LIMIT,
-                "searches_available": total_searches < GLOBAL_SEARCH_LIMIT,
-                "tryons_available": total_tryons < GLOBAL_TRYON_LIMIT,
-            }
-        return {
-            "total_searches": 0,
-            "total_tryons": 0,
-            "searches_remaining": GLOBAL_SEARCH_LIMIT,
-            "tryons_remaining": GLOBAL_TRYON_LIMIT,
-            "searches_available": True,
-            "tryons_available": True,
-        }
-    finally:
-        conn.close()
+    row = conn.execute("SELECT * FROM global_usage WHERE id = 1").fetchone()
+    if row:
+        return _global_usage_from_totals(row["total_searches"], row["total_tryons"])
+    return _global_usage_from_totals(0, 0)
+
+
+# Fast-path limit checks may see global counters up to a second stale
+GLOBAL_USAGE_CACHE_TTL = 1.0
+_global_usage_cache = TTLCache(maxsize=1, ttl=GLOBAL_USAGE_CACHE_TTL)
+
+
+def get_global_usage_cached() -> Dict:
+    """Get global usage stats, cached briefly (for fail-fast limit checks)"""
+    usage = _global_usage_cache.get("global")
+    if usage is None:
+        usage = get_global_usage()
+        _global_usage_cache.set("global", usage)
+    return usage
 
 
 def get_user_usage(user_id: str) -> Dict:
     """Get usage for a specific user"""
     conn = _get_connection()
-    try:
-        # Get user's usage
-        row = conn.execute(
-            "SELECT * FROM user_usage WHERE user_id = ?",
-            (user_id,)
-        ).fetchone()
-        
-        if row:
-            search_count = row["search_count"]
-            tryon_count = row["tryon_count"]
-        else:
-            search_count = 0
-            tryon_count = 0
+    # User's counters and global counters in one round trip
+    row = conn.execute("""
+        SELECT
+            g.total_searches,
+            g.total_tryons,
+            COALESCE(u.search_count, 0) AS search_count,
+            COALESCE(u.tryon_count, 0) AS tryon_count
+        FROM global_usage g
+        LEFT JOIN user_usage u ON u.user_id = ?
+        WHERE g.id = 1
+    """, (user_id,)).fetchone()
+    
+    if row:
+        search_count = row["search_count"]
+        tryon_count = row["tryon_count"]
+        global_usage = _global_usage_from_totals(row["total_searches"], row["total_tryons"])
+    else:
+        search_count = 0
+        tryon_count = 0
+        global_usage = _global_usage_from_totals(0, 0)
+    
+    # User can search if: they haven't used their 1 search AND global limit not reached
+    can_search = (search_count < USER_SEARCH_LIMIT) and global_usage["searches_available"]
+    
+    # User can try-on if: they haven't used their 1 try-on AND global limit not reached
+    can_tryon = (tryon_count < USER_TRYON_LIMIT) and global_usage["tryons_available"]
+    
+    return {
+        # User limits
+        "search_count": search_count,
+        "tryon_count": tryon_count,
+        "search_limit": USER_SEARCH_LIMIT,
+        "tryon_limit": USER_TRYON_LIMIT,
+        "can_search": can_search,
+        "can_tryon": can_tryon,
+        "search_exhausted": search_count >= USER_SEARCH_LIMIT,
+        "tryon_exhausted": tryon_count >= USER_TRYON_LIMIT,
         
-        # Get global usage
-        global_usage = get_global_usage()
+        # Global limits
+        "global_searches_remaining": global_usage["searches_remaining"],
+        "global_tryons_remaining": global_usage["tryons_remaining"],
         
-        # User can search if: they haven't used their 1 search AND global limit not reached
-        can_search = (search_count < USER_SEARCH_LIMIT) and global_usage["searches_available"]
-        
-        # User can try-on if: they haven't used their 1 try-on AND global limit not reached
-        can_tryon = (tryon_count < USER_TRYON_LIMIT) and global_usage["tryons_available"]
-        
-        return {
-            # User limits
-            "search_count": search_count,
-            "tryon_count": tryon_count,
-            "search_limit": USER_SEARCH_LIMIT,
-            "tryon_limit": USER_TRYON_LIMIT,
-            "can_search": can_search,
-            "can_tryon": can_tryon,
-            "search_exhausted": search_count >= USER_SEARCH_LIMIT,
-            "tryon_exhausted": tryon_count >= USER_TRYON_LIMIT,
-            
-            # Global limits
-            "global_searches_remaining": global_usage["searches_remaining"],
-            "global_tryons_remaining": global_usage["tryons_remaining"],
-            
-            # Legacy compatibility
-            "browse_count": search_count,
-            "browse_limit": USER_SEARCH_LIMIT,
-            "can_browse": can_search,
-        }
-        
-    finally:
-        conn.close()
+        # Legacy compatibility
+        "browse_count": search_count,
+        "browse_limit": USER_SEARCH_LIMIT,
+        "can_browse": can_search,
+    }
 
 
-def increment_search(user_id: str) -> bool:
+# Columns and limits per usage kind
+_USAGE_KINDS = {
+    "search": {
+        "user_column": "search_count",
+        "global_column": "total_searches",
+        "user_limit": USER_SEARCH_LIMIT,
+        "global_limit": GLOBAL_SEARCH_LIMIT,
+        "label": "Search",
+    },
+    "tryon": {
+        "user_column": "tryon_count",
+        "global_column": "total_tryons",
+        "user_limit": USER_TRYON_LIMIT,
+        "global_limit": GLOBAL_TRYON_LIMIT,
+        "label": "Try-on",
+    },
+}
+
+
+def _check_and_increment(user_id: str, kind: str) -> Dict:
     """
-    Increment search count for user.
-    Returns True if successful, False if limit reached.
+    Atomically check the user + global limits and consume one unit.
+    
+    Each counter is bumped by a conditional UPDATE (WHERE count < limit), so
+    the check and the increment are one statement and no SELECT is needed.
+    Both run in one IMMEDIATE transaction: if the user is out of quota the
+    global bump is rolled back, and concurrent requests can't double-spend.
+    
+    Returns:
+        {"allowed": bool, "reason": None | "user_exhausted" | "global_exhausted" | "error"}
     """
+    config = _USAGE_KINDS[kind]
+    user_column = config["user_column"]
+    global_column = config["global_column"]
     conn = _get_connection()
     try:
-        # Check global limit first
-        global_usage = get_global_usage()
-        if not global_usage["searches_available"]:
-            logger.warning(f"Global search limit reached!")
-            return False
+        conn.execute("BEGIN IMMEDIATE")
         
-        # Check user limit
-        user_usage = get_user_usage(user_id)
-        if user_usage["search_exhausted"]:
-            logger.warning(f"User {user_id[:8]}... already used their search")
-            return False
+        # Increment global count (only while under the global limit)
+        row = conn.execute(f"""
+            UPDATE global_usage
+            SET {global_column} = {global_column} + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = 1 AND {global_column} < ?
+            RETURNING {global_column} AS global_count
+        """, (config["global_limit"],)).fetchone()
+        if row is None:
+            conn.rollback()
+            logger.warning("Global %s limit reached!", kind)
+            return {"allowed": False, "reason": "global_exhausted"}
         
-        # Increment user count
-        conn.execute("""
-            INSERT INTO user_usage (user_id, search_count, tryon_count)
-            VALUES (?, 1, 0)
-            ON CONFLICT(user_id) DO UPDATE SET search_count = search_count + 1
-        """, (user_id,))
-        
-        # Increment global count
-        conn.execute("""
-            UPDATE global_usage 
-            SET total_searches = total_searches + 1, updated_at = CURRENT_TIMESTAMP
-            WHERE id = 1
-        """)
+        # Increment user count (only while under the user limit)
+        cursor = conn.execute(f"""
+            INSERT INTO user_usage (user_id, {user_column})
+            VALUES (?, 1)
+            ON CONFLICT(user_id) DO UPDATE SET {user_column} = {user_column} + 1
+            WHERE {user_column} < ?
+        """, (user_id, config["user_limit"]))
+        if cursor.rowcount == 0:
+            conn.rollback()
+            logger.warning("User %s... already used their %s", user_id[:8], kind)
+            return {"allowed": False, "reason": "user_exhausted"}
         
         conn.commit()
-        logger.info(f"✅ Search used by {user_id[:8]}... (Global: {global_usage['total_searches'] + 1}/{GLOBAL_SEARCH_LIMIT})")
-        return True
+        _global_usage_cache.clear()
+        logger.info("✅ %s used by %s... (Global: %s/%s)", config['label'], user_id[:8], row["global_count"], config['global_limit'])
+        return {"allowed": True, "reason": None}
         
     except Exception as e:
-        logger.error(f"Failed to increment search: {e}")
+        logger.error("Failed to increment %s: %s", kind, e)
         conn.rollback()
-        return False
-    finally:
-        conn.close()
+        return {"allowed": False, "reason": "error"}
+
+
+def check_and_increment_search(user_id: str) -> Dict:
+    """Atomically check limits and use one search (see _check_and_increment)"""
+    return _check_and_increment(user_id, "search")
+
+
+def check_and_increment_tryon(user_id: str) -> Dict:
+    """Atomically check limits and use one try-on (see _check_and_increment)"""
+    return _check_and_increment(user_id, "tryon")
+
+
+def increment_search(user_id: str) -> bool:
+    """
+    Increment search count for user.
+    Returns True if successful, False if limit reached.
+    """
+    return check_and_increment_search(user_id)["allowed"]
 
 
 def increment_tryon(user_id: str) -> bool:
@@ -206,44 +302,7 @@ def increment_tryon(user_id: str) -> bool:
     Increment try-on count for user.
     Returns True if successful, False if limit reached.
     """
-    conn = _get_connection()
-    try:
-        # Check global limit first
-        global_usage = get_global_usage()
-        if not global_usage["tryons_available"]:
-            logger.warning(f"Global try-on limit reached!")
-            return False
-        
-        # Check user limit
-        user_usage = get_user_usage(user_id)
-        if user_usage["tryon_exhausted"]:
-            logger.warning(f"User {user_id[:8]}... already used their try-on")
-            return False
-        
-        # Increment user count
-        conn.execute("""
-            INSERT INTO user_usage (user_id, search_count, tryon_count)
-            VALUES (?, 0, 1)
-            ON CONFLICT(user_id) DO UPDATE SET tryon_count = tryon_count + 1
-        """, (user_id,))
-        
-        # Increment global count
-        conn.execute("""
-            UPDATE global_usage 
-            SET total_tryons = total_tryons + 1, updated_at = CURRENT_TIMESTAMP
-            WHERE id = 1
-        """)
-        
-        conn.commit()
-        logger.info(f"✅ Try-on used by {user_id[:8]}... (Global: {global_usage['total_tryons'] + 1}/{GLOBAL_TRYON_LIMIT})")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Failed to increment try-on: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
+    return check_and_increment_tryon(user_id)["allowed"]
 
 
 # Legacy function names for compatibility
@@ -255,21 +314,23 @@ def increment_browse(user_id: str) -> bool:
 def get_admin_stats() -> Dict:
     """Get admin statistics (for monitoring)"""
     conn = _get_connection()
-    try:
-        # Count total users
-        user_count = conn.execute("SELECT COUNT(*) FROM user_usage").fetchone()[0]
-        
-        # Get global usage
-        global_usage = get_global_usage()
-        
-        return {
-            "total_users": user_count,
-            "total_searches_used": global_usage["total_searches"],
-            "total_tryons_used": global_usage["total_tryons"],
-            "searches_remaining": global_usage["searches_remaining"],
-            "tryons_remaining": global_usage["tryons_remaining"],
-            "global_search_limit": GLOBAL_SEARCH_LIMIT,
-            "global_tryon_limit": GLOBAL_TRYON_LIMIT,
-        }
-    finally:
-        conn.close()
+    # User count is trigger-maintained, so this is a single-row read
+    row = conn.execute("""
+        SELECT total_users, total_searches, total_tryons
+        FROM global_usage
+        WHERE id = 1
+    """).fetchone()
+
+    user_count = row["total_users"] if row else 0
+    total_searches = row["total_searches"] if row else 0
+    total_tryons = row["total_tryons"] if row else 0
+
+    return {
+        "total_users": user_count,
+        "total_searches_used": total_searches,
+        "total_tryons_used": total_tryons,
+        "searches_remaining": max(0, GLOBAL_SEARCH_LIMIT - total_searches),
+        "tryons_remaining": max(0, GLOBAL_TRYON_LIMIT - total_tryons),
+        "global_search_limit": GLOBAL_SEARCH_LIMIT,
+        "global_tryon_limit": GLOBAL_TRYON_LIMIT,
+    }